@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from typing import Optional
+from config import DB_PATH, ANALYTICS_CACHE_DIR, ANALYTICS_WINDOW_YEARS
+import db_access
+from db_access import SNAPSHOT_CTE
+
+class DividendMatrix:
+    """Дивиденды всех тикеров в виде матриц тикер x год.
+
+    amounts - сумма годовых дивидендов (NaN, если за год данных нет),
+    payment_counts и payment_sums - количество и сумма отдельных выплат за год.
+    """
+
+    def __init__(self, run_id, tickers, names, sectors, years, amounts, payment_counts, payment_sums):
+        self.run_id = run_id
+        self.tickers = tickers
+        self.names = names
+        self.sectors = sectors
+        self.years = years
+        self.amounts = amounts
+        self.payment_counts = payment_counts
+        self.payment_sums = payment_sums
+
+    def year_columns(self, first_year: int, last_year: int) -> np.ndarray:
+        """Индексы столбцов матриц для лет из диапазона"""
+        return np.flatnonzero((self.years >= first_year) & (self.years <= last_year))
+
+def get_default_run_id(conn) -> Optional[int]:
+    """ID последнего завершенного запуска (или последнего запуска вообще)"""
+    row = conn.execute(
+        "SELECT COALESCE(MAX(CASE WHEN status = 'completed' THEN id END), MAX(id)) FROM parsing_runs"
+    ).fetchone()
+    return row[0] if row else None
+
+def load_matrix(conn, run_id: int) -> DividendMatrix:
+    """Загружает годовые дивиденды и выплаты снимка запуска одним проходом по каждой таблице"""
+    companies = conn.execute(
+        SNAPSHOT_CTE + "SELECT ticker, name, sector FROM snapshot ORDER BY ticker",
+        {'run_id': run_id}
+    ).fetchall()
+    tickers = np.array([row[0] for row in companies], dtype=object)
+    names = np.array([row[1] for row in companies], dtype=object)
+    sectors = np.array([row[2] for row in companies], dtype=object)
+
+    yearly = conn.execute(
+        SNAPSHOT_CTE + """
+        SELECT s.ticker, CAST(yd.year AS INTEGER), ru_amount(yd.total_amount)
+        FROM yearly_dividends yd
+        JOIN snapshot s ON yd.company_id = s.id
+        """,
+        {'run_id': run_id}
+    ).fetchall()
+    payments = conn.execute(
+        SNAPSHOT_CTE + """
+        SELECT s.ticker, CAST(dp.year AS INTEGER), ru_amount(dp.amount)
+        FROM dividend_payments dp
+        JOIN snapshot s ON dp.company_id = s.id
+        """,
+        {'run_id': run_id}
+    ).fetchall()
+
+    def columns(rows):
+        if not rows:
+            return np.array([], dtype=object), np.array([], dtype=np.int64), np.array([], dtype=float)
+        ticker_column, year_column, amount_column = zip(*rows)
+        return (
+            np.array(ticker_column, dtype=object),
+            np.array([year or 0 for year in year_column], dtype=np.int64),
+            np.array([np.nan if amount is None else amount for amount in amount_column], dtype=float),
+        )
+
+    yearly_tickers, yearly_years, yearly_amounts = columns(yearly)
+    payment_tickers, payment_years, payment_amounts = columns(payments)
+
+    # Строки без распознанного года (прогнозы, пустые ячейки) в матрицы не попадают
+    years = np.unique(np.concatenate([yearly_years[yearly_years > 0], payment_years[payment_years > 0]]))
+
+    amounts = np.full((len(tickers), len(years)), np.nan)
+    mask = yearly_years > 0
+    rows = np.searchsorted(tickers, yearly_tickers[mask])
+    cols = np.searchsorted(years, yearly_years[mask])
+    amounts[rows, cols] = yearly_amounts[mask]
+
+    payment_counts = np.zeros((len(tickers), len(years)), dtype=np.int64)
+    payment_sums = np.zeros((len(tickers), len(years)))
+    mask = payment_years > 0
+    rows = np.searchsorted(tickers, payment_tickers[mask])
+    cols = np.searchsorted(years, payment_years[mask])
+    np.add.at(payment_counts, (rows, cols), 1)
+    np.add.at(payment_sums, (rows, cols), np.nan_to_num(payment_amounts[mask]))
+
+    return DividendMatrix(run_id, tickers, names, sectors, years, amounts, payment_counts, payment_sums)
+
+def yoy_growth(matrix: DividendMatrix) -> np.ndarray:
+    """Рост дивидендов год к году (матрица тикер x год, первый год - NaN)"""
+    growth = np.full(matrix.amounts.shape, np.nan)
+    prev = matrix.amounts[:, :-1]
+    curr = matrix.amounts[:, 1:]
+    # Рост считается только между соседними годами и при положительной базе
+    adjacent = np.diff(matrix.years) == 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth[:, 1:] = np.where((prev > 0) & adjacent, curr / prev - 1, np.nan)
+    return growth
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    """Место по убыванию значения (1 - лучший), NaN для тикеров без значения"""
+    ranks = np.full(values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(values))
+    order = valid[np.argsort(-values[valid], kind='stable')]
+    ranks[order] = np.arange(1, len(order) + 1)
+    return ranks
+
+def compute_metrics(matrix: DividendMatrix, end_year: Optional[int] = None,
+                    window: int = ANALYTICS_WINDOW_YEARS) -> pd.DataFrame:
+    """Считает показатели роста и стабильности дивидендов для всех тикеров.
+
+    Окно - window лет, заканчивающихся end_year (по умолчанию последний
+    завершенный год). Возвращает DataFrame с индексом по тикеру.
+    """
+    end_year = end_year or date.today().year - 1
+    start_year = end_year - window + 1
+    amounts = matrix.amounts
+    year_index = {year: i for i, year in enumerate(matrix.years)}
+
+    def year_values(year, source):
+        if year in year_index:
+            return source[:, year_index[year]].astype(float)
+        return np.full(len(matrix.tickers), np.nan)
+
+    start_amount = year_values(start_year, amounts)
+    end_amount = year_values(end_year, amounts)
+    prev_amount = year_values(end_year - 1, amounts)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        last_yoy = np.where(prev_amount > 0, end_amount / prev_amount - 1, np.nan)
+        cagr = np.where(
+            (start_amount > 0) & (end_amount > 0),
+            (end_amount / start_amount) ** (1 / max(window - 1, 1)) - 1,
+            np.nan
+        )
+
+    window_columns = matrix.year_columns(start_year, end_year)
+    window_amounts = np.nan_to_num(amounts[:, window_columns])
+    window_counts = matrix.payment_counts[:, window_columns].astype(float)
+
+    # Доля лет окна с ненулевыми дивидендами; отсутствующие в данных годы считаются пропуском выплаты
+    regularity = (window_amounts > 0).sum(axis=1) / window
+
+    # Стабильность количества выплат: 1 - коэффициент вариации числа выплат по годам окна
+    full_counts = np.zeros((len(matrix.tickers), window))
+    if len(window_columns):
+        full_counts[:, matrix.years[window_columns] - start_year] = window_counts
+    mean_counts = full_counts.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stability = np.where(
+            mean_counts > 0,
+            np.clip(1 - full_counts.std(axis=1) / mean_counts, 0, 1),
+            np.nan
+        )
+
+    yoy_window = yoy_growth(matrix)[:, window_columns]
+    with np.errstate(invalid='ignore'):
+        growth_years = (yoy_window > 0).sum(axis=1)
+
+    metrics = pd.DataFrame({
+        'name': matrix.names,
+        'sector': matrix.sectors,
+        'start_amount': start_amount,
+        'end_amount': end_amount,
+        'last_yoy': last_yoy,
+        'cagr': cagr,
+        'growth_years': growth_years,
+        'regularity': regularity,
+        'payments_per_year': mean_counts,
+        'payment_stability': stability,
+    }, index=pd.Index(matrix.tickers, name='ticker'))
+
+    metrics['cagr_rank'] = _rank(cagr)
+    metrics['yoy_rank'] = _rank(last_yoy)
+    # Составной рейтинг: регулярность и стабильность выплат важнее роста
+    score = np.nan_to_num(regularity) + np.nan_to_num(stability) + np.clip(np.nan_to_num(cagr), -1, 1)
+    metrics['score'] = score
+    metrics['score_rank'] = _rank(score)
+
+    metrics.attrs.update({'run_id': matrix.run_id, 'start_year': start_year, 'end_year': end_year})
+    return metrics
+
+def get_metrics(run_id: Optional[int] = None, end_year: Optional[int] = None,
+                window: int = ANALYTICS_WINDOW_YEARS, db_path=DB_PATH) -> pd.DataFrame:
+    """Возвращает показатели по всем тикерам для снимка запуска, используя кэш на диске"""
+    end_year = end_year or date.today().year - 1
+
+    with db_access.reader(db_path) as conn:
+        run_id = run_id or get_default_run_id(conn)
+        if run_id is None:
+            raise ValueError("В базе данных нет запусков парсера")
+
+        cache_path = ANALYTICS_CACHE_DIR / f"run_{run_id}_{end_year}_{window}.pkl"
+        if cache_path.exists():
+            return pd.read_pickle(cache_path)
+
+        metrics = compute_metrics(load_matrix(conn, run_id), end_year, window)
+
+    # Снимок завершенного запуска не меняется, поэтому результат можно хранить
+    ANALYTICS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    metrics.to_pickle(cache_path)
+    return metrics
+
+def screen(metrics: pd.DataFrame, min_cagr: Optional[float] = None,
+           min_regularity: Optional[float] = None, min_stability: Optional[float] = None,
+           sector: Optional[str] = None, sort_by: str = 'score', top: Optional[int] = None) -> pd.DataFrame:
+    """Отбирает тикеры по порогам показателей"""
+    mask = np.ones(len(metrics), dtype=bool)
+    if min_cagr is not None:
+        mask &= (metrics['cagr'] >= min_cagr).to_numpy()
+    if min_regularity is not None:
+        mask &= (metrics['regularity'] >= min_regularity).to_numpy()
+    if min_stability is not None:
+        mask &= (metrics['payment_stability'] >= min_stability).to_numpy()
+    if sector is not None:
+        mask &= (metrics['sector'] == sector).to_numpy()
+
+    result = metrics[mask].sort_values(sort_by, ascending=False, na_position='last')
+    return result.head(top) if top else result
+
+if __name__ == "__main__":
+    metrics = get_metrics()
+    print(f"Снимок запуска {metrics.attrs['run_id']}, "
+          f"окно {metrics.attrs['start_year']}-{metrics.attrs['end_year']}")
+    columns = ['name', 'cagr', 'last_yoy', 'regularity', 'payment_stability', 'score']
+    print(screen(metrics, top=20)[columns].to_string())
@@ -1,8 +1,21 @@
 import os
-import sqlite3
+import glob
+import json
+import shutil
 import pandas as pd
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from config import DB_PATH
+from config import DB_PATH, DIFF_WORKERS, DIFF_OUTPUT_FORMATS, DIFF_BATCH_SIZE, DIFF_STORE_RECORDS
+import sql_functions
+import db_access
+import database  # Создает недостающие таблицы (например, ticker_observations) в старых базах
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
 
 def ensure_diff_dir_exists():
     """Создает директорию для отчетов, если она не существует"""
@@ -19,30 +32,452 @@ def get_last_two_run_ids(conn):
     if len(runs) < 2:
         return None, None, None
     
-    last_run_id = runs.iloc[0]['id']
-    prev_run_id = runs.iloc[1]['id']
+    last_run_id = int(runs.iloc[0]['id'])
+    prev_run_id = int(runs.iloc[1]['id'])
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
     return last_run_id, prev_run_id, timestamp
 
-def compare_companies(conn, last_run_id, prev_run_id, diff_dir, timestamp):
-    """Сравнивает компании между двумя запусками"""
-    # Получаем компании из последнего запуска
-    last_companies_query = f"""
-    SELECT ticker, name, sector, parsed_at
-    FROM companies
-    WHERE parsing_run_id = {last_run_id}
+# CTE prev_companies с последним успешным наблюдением каждого тикера.
+# В сравнение попадают тикеры снимка предыдущего запуска (см. db_access.snapshot_cte):
+# известные в нем (обработанные или пропущенные по бюджету), для каждого - самая
+# свежая запись не позже предыдущего запуска. Тикеры, которые в последнем запуске
+# не были успешно обработаны, из сравнения исключаются, чтобы не считаться удаленными.
+# Параметры :last_run_id и :prev_run_id (см. run_pair_params)
+PREVIOUS_SNAPSHOT_CTE = db_access.snapshot_cte('prev_run_id') + """,
+prev_companies AS (
+    SELECT * FROM snapshot
+    WHERE ticker NOT IN (
+        SELECT ticker FROM ticker_observations
+        WHERE parsing_run_id = :last_run_id AND status != 'parsed'
+    )
+)
+"""
+
+# Запросы сравнения с параметрами вместо подставленных ID запусков: текст запроса
+# не меняется, поэтому подготовленный запрос берется из кэша подключения
+LAST_COMPANIES_QUERY = """
+SELECT ticker, name, sector, parsed_at
+FROM companies
+WHERE parsing_run_id = :last_run_id
+"""
+
+PREV_COMPANIES_QUERY = PREVIOUS_SNAPSHOT_CTE + """
+SELECT ticker, name, sector, parsed_at
+FROM prev_companies
+"""
+
+LAST_DIVIDENDS_QUERY = """
+SELECT c.ticker, yd.year, yd.total_amount
+FROM yearly_dividends yd
+JOIN companies c ON yd.company_id = c.id
+WHERE c.parsing_run_id = :last_run_id
+"""
+
+PREV_DIVIDENDS_QUERY = PREVIOUS_SNAPSHOT_CTE + """
+SELECT c.ticker, yd.year, yd.total_amount
+FROM yearly_dividends yd
+JOIN prev_companies c ON yd.company_id = c.id
+"""
+
+LAST_PAYMENTS_QUERY = """
+SELECT c.ticker, dp.year, dp.amount, dp.cutoff_date, dp.payment_date
+FROM dividend_payments dp
+JOIN companies c ON dp.company_id = c.id
+WHERE c.parsing_run_id = :last_run_id
+"""
+
+PREV_PAYMENTS_QUERY = PREVIOUS_SNAPSHOT_CTE + """
+SELECT c.ticker, dp.year, dp.amount, dp.cutoff_date, dp.payment_date
+FROM dividend_payments dp
+JOIN prev_companies c ON dp.company_id = c.id
+"""
+
+def run_pair_params(last_run_id, prev_run_id):
+    """Параметры запросов сравнения пары запусков"""
+    return {'last_run_id': int(last_run_id), 'prev_run_id': int(prev_run_id)}
+
+# Заголовки отчетов и разделов: сущность -> (заголовок отчета, {изменение: (раздел, пустой раздел)})
+REPORT_SECTIONS = {
+    'companies': (
+        "Отчет по изменениям в компаниях между запусками",
+        {
+            'new': ("НОВЫЕ КОМПАНИИ:", "Нет новых компаний"),
+            'removed': ("УДАЛЕННЫЕ КОМПАНИИ:", "Нет удаленных компаний"),
+            'changed': ("ИЗМЕНЕННЫЕ КОМПАНИИ:", "Нет измененных компаний"),
+        }
+    ),
+    'yearly_dividends': (
+        "Отчет по изменениям в годовых дивидендах между запусками",
+        {
+            'new': ("НОВЫЕ ГОДОВЫЕ ДИВИДЕНДЫ:", "Нет новых данных о годовых дивидендах"),
+            'removed': ("УДАЛЕННЫЕ ГОДОВЫЕ ДИВИДЕНДЫ:", "Нет удаленных данных о годовых дивидендах"),
+            'changed': ("ИЗМЕНЕННЫЕ ГОДОВЫЕ ДИВИДЕНДЫ:", "Нет измененных данных о годовых дивидендах"),
+        }
+    ),
+    'dividend_payments': (
+        "Отчет по изменениям в выплатах дивидендов между запусками",
+        {
+            'new': ("НОВЫЕ ВЫПЛАТЫ:", "Нет новых выплат"),
+            'removed': ("УДАЛЕННЫЕ ВЫПЛАТЫ:", "Нет удаленных выплат"),
+            'changed': ("ИЗМЕНЕННЫЕ ВЫПЛАТЫ:", "Нет измененных выплат"),
+        }
+    ),
+}
+
+CHANGE_TYPES = ('new', 'removed', 'changed')
+
+# Поля записи о различии для каждой пары (сущность, изменение)
+RECORD_FIELDS = {
+    ('companies', 'new'): ['ticker', 'name', 'sector'],
+    ('companies', 'removed'): ['ticker', 'name', 'sector'],
+    ('companies', 'changed'): ['ticker', 'name_prev', 'name_last', 'sector_prev', 'sector_last'],
+    ('yearly_dividends', 'new'): ['ticker', 'year', 'total_amount'],
+    ('yearly_dividends', 'removed'): ['ticker', 'year', 'total_amount'],
+    ('yearly_dividends', 'changed'): ['ticker', 'year', 'total_amount_prev', 'total_amount_last'],
+    ('dividend_payments', 'new'): ['ticker', 'year', 'amount', 'cutoff_date', 'payment_date'],
+    ('dividend_payments', 'removed'): ['ticker', 'year', 'amount', 'cutoff_date', 'payment_date'],
+    ('dividend_payments', 'changed'): ['ticker', 'year', 'cutoff_date', 'payment_date', 'amount_prev', 'amount_last'],
+}
+
+# Столбцы машиночитаемых отчетов: тип записи и объединение полей всех записей
+RECORD_COLUMNS = ['entity', 'change'] + list(dict.fromkeys(
+    field for fields in RECORD_FIELDS.values() for field in fields
+))
+
+# Машиночитаемые форматы отчетов (расширение файла -> запись в DiffReportWriter)
+STREAM_FORMATS = ('jsonl', 'parquet')
+
+def make_record(entity, change, row):
+    """Создает запись о различии из строки данных (словаря или строки DataFrame)"""
+    record = {'entity': entity, 'change': change}
+    for field in RECORD_FIELDS[(entity, change)]:
+        record[field] = row[field]
+    return record
+
+def format_record(record):
+    """Форматирует запись о различии для текстового отчета"""
+    entity, change = record['entity'], record['change']
+    
+    if entity == 'companies':
+        if change != 'changed':
+            return f"Тикер: {record['ticker']}, Название: {record['name']}, Сектор: {record['sector']}\n"
+        text = f"Тикер: {record['ticker']}\n"
+        if record['name_last'] != record['name_prev']:
+            text += f"Старое название: {record['name_prev']}\n"
+            text += f"Новое название: {record['name_last']}\n"
+        if record['sector_last'] != record['sector_prev']:
+            text += f"Старый сектор: {record['sector_prev']}\n"
+            text += f"Новый сектор: {record['sector_last']}\n"
+        return text + "-" * 40 + "\n"
+    
+    text = f"Тикер: {record['ticker']}, Год: {record['year']}\n"
+    if entity == 'yearly_dividends':
+        if change != 'changed':
+            text += f"Сумма: {record['total_amount']}\n"
+        else:
+            text += f"Старая сумма: {record['total_amount_prev']}\n"
+            text += f"Новая сумма: {record['total_amount_last']}\n"
+    elif change != 'changed':
+        text += f"Размер: {record['amount']}\n"
+        text += f"Дата отсечки: {record['cutoff_date']}\n"
+        text += f"Дата выплаты: {record['payment_date']}\n"
+    else:
+        text += f"Дата отсечки: {record['cutoff_date']}, Дата выплаты: {record['payment_date']}\n"
+        text += f"Старый размер: {record['amount_prev']}\n"
+        text += f"Новый размер: {record['amount_last']}\n"
+    return text + "-" * 40 + "\n"
+
+class DiffRecordSink(ABC):
+    """Приемник записей о различиях, в который функции compare_* передают результаты"""
+    
+    @abstractmethod
+    def add(self, record):
+        """Принимает одну запись о различии"""
+    
+    def add_frame(self, entity, change, frame):
+        """Добавляет все строки DataFrame как записи о различиях"""
+        for row in frame.to_dict('records'):
+            self.add(make_record(entity, change, row))
+    
+    def close(self):
+        """Завершает запись, возвращает путь к созданному файлу (если он есть)"""
+        return None
+    
+    def discard(self):
+        """Отменяет запись и удаляет незавершенные данные"""
+
+class DiffRecordCollector(DiffRecordSink):
+    """Собирает записи о различиях в список"""
+    
+    def __init__(self):
+        self.records = []
+    
+    def add(self, record):
+        self.records.append(record)
+
+class BufferedRecordSink(DiffRecordSink):
+    """Накапливает записи о различиях и передает их в _write_batch пакетами по batch_size"""
+    
+    def __init__(self, batch_size=DIFF_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.batch = []
+        self.total = 0
+    
+    def add(self, record):
+        self.batch.append(record)
+        self.total += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+    
+    def flush(self):
+        """Записывает накопленный пакет"""
+        if self.batch:
+            self._write_batch(self.batch)
+            self.batch = []
+    
+    @abstractmethod
+    def _write_batch(self, records):
+        """Записывает пакет записей"""
+
+def _part_path(path):
+    """Временный файл, в который пишется отчет до завершения сравнения"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.part")
+
+class JsonLinesSink(BufferedRecordSink):
+    """Записывает записи о различиях в файл JSON Lines (одна запись в строке)"""
+    
+    def __init__(self, path, batch_size=DIFF_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.path = path
+        self.file = open(_part_path(path), 'w', encoding='utf-8')
+    
+    def _write_batch(self, records):
+        self.file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+        os.replace(self.file.name, self.path)
+        return self.path
+    
+    def discard(self):
+        self.file.close()
+        os.remove(self.file.name)
+
+class ParquetSink(BufferedRecordSink):
+    """Записывает записи о различиях в файл Parquet, каждый пакет - отдельная группа строк.
+
+    Все столбцы строковые (как в базе данных), отсутствующие в записи поля - NULL.
     """
     
-    # Получаем компании из предыдущего запуска
-    prev_companies_query = f"""
-    SELECT ticker, name, sector, parsed_at
-    FROM companies
-    WHERE parsing_run_id = {prev_run_id}
+    def __init__(self, path, batch_size=DIFF_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.path = path
+        self.schema = pa.schema([(column, pa.string()) for column in RECORD_COLUMNS])
+        self.writer = pq.ParquetWriter(_part_path(path), self.schema)
+    
+    def _write_batch(self, records):
+        columns = {
+            column: [None if record.get(column) is None else str(record[column]) for record in records]
+            for column in RECORD_COLUMNS
+        }
+        self.writer.write_table(pa.table(columns, schema=self.schema))
+    
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(_part_path(self.path), self.path)
+        return self.path
+    
+    def discard(self):
+        self.writer.close()
+        os.remove(_part_path(self.path))
+
+def _insert_records(conn, diff_pair_id, records):
+    """Добавляет записи о различиях пары запусков в таблицу diff_records"""
+    conn.executemany(
+        "INSERT INTO diff_records (diff_pair_id, entity, change, ticker, payload) VALUES (?, ?, ?, ?, ?)",
+        (
+            (diff_pair_id, record['entity'], record['change'], record['ticker'],
+             json.dumps(record, ensure_ascii=False))
+            for record in records
+        )
+    )
+
+def _delete_incomplete_pair(conn, last_run_id, prev_run_id):
+    """Удаляет незавершенную запись пары запусков, оставшуюся от прерванного сравнения"""
+    incomplete = "SELECT id FROM diff_pairs WHERE prev_run_id = ? AND last_run_id = ? AND total_changes IS NULL"
+    conn.execute(f"DELETE FROM diff_records WHERE diff_pair_id IN ({incomplete})", (prev_run_id, last_run_id))
+    conn.execute(f"DELETE FROM diff_pairs WHERE id IN ({incomplete})", (prev_run_id, last_run_id))
+
+class DiffTableSink(BufferedRecordSink):
+    """Сохраняет записи о различиях пары запусков в таблицу diff_records по мере их появления.
+
+    Пара регистрируется в diff_pairs с total_changes = NULL, записи добавляются
+    пакетами, а в close() проставляется их количество. До этого пара не считается
+    сохраненной (см. load_cached_diff).
+    """
+    
+    def __init__(self, conn, last_run_id, prev_run_id, batch_size=DIFF_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.conn = conn
+        with conn:
+            _delete_incomplete_pair(conn, last_run_id, prev_run_id)
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO diff_pairs (prev_run_id, last_run_id, total_changes, computed_at) "
+                "VALUES (?, ?, NULL, ?)",
+                (prev_run_id, last_run_id, datetime.now())
+            )
+        # Если пара уже сохранена полностью, повторно ее не записываем
+        self.diff_pair_id = cursor.lastrowid if cursor.rowcount else None
+    
+    def _write_batch(self, records):
+        if self.diff_pair_id is not None:
+            with self.conn:
+                _insert_records(self.conn, self.diff_pair_id, records)
+    
+    def close(self):
+        self.flush()
+        if self.diff_pair_id is not None:
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE diff_pairs SET total_changes = ?, computed_at = ? WHERE id = ?",
+                    (self.total, datetime.now(), self.diff_pair_id)
+                )
+        return None
+    
+    def discard(self):
+        if self.diff_pair_id is not None:
+            with self.conn:
+                self.conn.execute("DELETE FROM diff_records WHERE diff_pair_id = ?", (self.diff_pair_id,))
+                self.conn.execute("DELETE FROM diff_pairs WHERE id = ?", (self.diff_pair_id,))
+
+class DiffReportWriter(DiffRecordSink):
+    """Принимает записи о различиях по мере их появления и формирует отчеты.
+
+    Записи каждого раздела текстового отчета сразу дописываются во временный файл,
+    поэтому их можно добавлять как после полного сравнения запусков, так и во время
+    парсинга. Тот же поток записей пакетами пишется в машиночитаемые отчеты
+    (formats) и, если передано подключение table_conn, в таблицу diff_records.
+    Итоговые отчеты собираются в close().
     """
     
-    last_companies = pd.read_sql_query(last_companies_query, conn)
-    prev_companies = pd.read_sql_query(prev_companies_query, conn)
+    def __init__(self, diff_dir, last_run_id, prev_run_id, timestamp, on_change=None,
+                 formats=DIFF_OUTPUT_FORMATS, table_conn=None):
+        self.diff_dir = diff_dir
+        self.last_run_id = last_run_id
+        self.prev_run_id = prev_run_id
+        self.timestamp = timestamp
+        self.on_change = on_change
+        self.file_prefix = f"iter_{prev_run_id}_{last_run_id}_"
+        self.counts = {(entity, change): 0 for entity in REPORT_SECTIONS for change in CHANGE_TYPES}
+        self._parts = {}
+        self._streams = {}
+        for output_format in formats:
+            sink = self._open_stream(output_format)
+            if sink is not None:
+                self._streams[output_format] = sink
+        if table_conn is not None and DIFF_STORE_RECORDS:
+            self._streams['table'] = DiffTableSink(table_conn, last_run_id, prev_run_id)
+    
+    def _report_path(self, name):
+        return os.path.join(self.diff_dir, f"{self.file_prefix}{name}_diff_{self.timestamp}.txt")
+    
+    def _stream_path(self, output_format):
+        return os.path.join(self.diff_dir, f"{self.file_prefix}records_{self.timestamp}.{output_format}")
+    
+    def _open_stream(self, output_format):
+        if output_format == 'jsonl':
+            return JsonLinesSink(self._stream_path(output_format))
+        if output_format == 'parquet':
+            if pq is None:
+                print("Отчет в формате Parquet не создается: не установлен pyarrow")
+                return None
+            return ParquetSink(self._stream_path(output_format))
+        raise ValueError(f"Неизвестный формат отчета: {output_format}")
+    
+    def _part_path(self, entity, change):
+        return os.path.join(self.diff_dir, f".{self.file_prefix}{entity}_{change}_{self.timestamp}.part")
+    
+    def add(self, record):
+        """Добавляет запись о различии в соответствующий раздел отчета"""
+        key = (record['entity'], record['change'])
+        if key not in self._parts:
+            self._parts[key] = open(self._part_path(*key), 'w', encoding='utf-8')
+        self._parts[key].write(format_record(record))
+        self.counts[key] += 1
+        for sink in self._streams.values():
+            sink.add(record)
+        
+        if self.on_change:
+            self.on_change(record)
+    
+    def count(self, entity, change=None):
+        """Количество записей по сущности (и типу изменения)"""
+        if change is not None:
+            return self.counts[(entity, change)]
+        return sum(self.counts[(entity, change)] for change in CHANGE_TYPES)
+    
+    def _write_entity_report(self, entity):
+        title, sections = REPORT_SECTIONS[entity]
+        path = self._report_path(entity)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"{title} {self.prev_run_id} и {self.last_run_id}\n")
+            f.write("=" * 80 + "\n\n")
+            
+            for i, change in enumerate(CHANGE_TYPES):
+                section_title, empty_text = sections[change]
+                f.write(f"{section_title}\n")
+                f.write("-" * 80 + "\n")
+                part = self._parts.pop((entity, change), None)
+                if part is None:
+                    f.write(f"{empty_text}\n")
+                else:
+                    part.close()
+                    with open(part.name, 'r', encoding='utf-8') as part_file:
+                        shutil.copyfileobj(part_file, f)
+                    os.remove(part.name)
+                if i < len(CHANGE_TYPES) - 1:
+                    f.write("\n")
+        return path
+    
+    def close(self):
+        """Собирает итоговые отчеты и сводку, возвращает пути к файлам"""
+        streams = {}
+        for name, sink in self._streams.items():
+            path = sink.close()
+            if path is not None:
+                streams[f'{name}_file'] = path
+        self._streams = {}
+        
+        # Сводка создается последней: по ней find_existing_reports определяет готовые отчеты
+        files = {entity: self._write_entity_report(entity) for entity in REPORT_SECTIONS}
+        result = create_summary_report(
+            self._report_path('summary'), self.last_run_id, self.prev_run_id, self, files
+        )
+        result.update(streams)
+        return result
+    
+    def discard(self):
+        """Удаляет временные файлы без формирования отчетов"""
+        for part in self._parts.values():
+            part.close()
+            os.remove(part.name)
+        self._parts = {}
+        for sink in self._streams.values():
+            sink.discard()
+        self._streams = {}
+
+def compare_companies(conn, last_run_id, prev_run_id, writer):
+    """Сравнивает компании между двумя запусками"""
+    params = run_pair_params(last_run_id, prev_run_id)
+    
+    # Компании из последнего запуска и последние успешные наблюдения компаний
+    # на момент предыдущего запуска
+    last_companies = pd.read_sql_query(LAST_COMPANIES_QUERY, conn, params=params)
+    prev_companies = pd.read_sql_query(PREV_COMPANIES_QUERY, conn, params=params)
     
     # Компании, которые есть только в последнем запуске (новые)
     new_companies = last_companies[~last_companies['ticker'].isin(prev_companies['ticker'])]
@@ -58,69 +493,19 @@ def compare_companies(conn, last_run_id, prev_run_id, diff_dir, timestamp):
     changed_companies = merged[(merged['name_last'] != merged['name_prev']) | 
                                (merged['sector_last'] != merged['sector_prev'])]
     
-    # Формируем отчет
-    with open(os.path.join(diff_dir, f"companies_diff_{timestamp}.txt"), 'w', encoding='utf-8') as f:
-        f.write(f"Отчет по изменениям в компаниях между запусками {prev_run_id} и {last_run_id}\n")
-        f.write("=" * 80 + "\n\n")
-        
-        f.write("НОВЫЕ КОМПАНИИ:\n")
-        f.write("-" * 80 + "\n")
-        if len(new_companies) == 0:
-            f.write("Нет новых компаний\n")
-        else:
-            for _, row in new_companies.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Название: {row['name']}, Сектор: {row['sector']}\n")
-        f.write("\n")
-        
-        f.write("УДАЛЕННЫЕ КОМПАНИИ:\n")
-        f.write("-" * 80 + "\n")
-        if len(removed_companies) == 0:
-            f.write("Нет удаленных компаний\n")
-        else:
-            for _, row in removed_companies.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Название: {row['name']}, Сектор: {row['sector']}\n")
-        f.write("\n")
-        
-        f.write("ИЗМЕНЕННЫЕ КОМПАНИИ:\n")
-        f.write("-" * 80 + "\n")
-        if len(changed_companies) == 0:
-            f.write("Нет измененных компаний\n")
-        else:
-            for _, row in changed_companies.iterrows():
-                f.write(f"Тикер: {row['ticker']}\n")
-                
-                if row['name_last'] != row['name_prev']:
-                    f.write(f"Старое название: {row['name_prev']}\n")
-                    f.write(f"Новое название: {row['name_last']}\n")
-                
-                if row['sector_last'] != row['sector_prev']:
-                    f.write(f"Старый сектор: {row['sector_prev']}\n")
-                    f.write(f"Новый сектор: {row['sector_last']}\n")
-                    
-                f.write("-" * 40 + "\n")
-        
+    writer.add_frame('companies', 'new', new_companies)
+    writer.add_frame('companies', 'removed', removed_companies)
+    writer.add_frame('companies', 'changed', changed_companies)
+    
     return new_companies, removed_companies, changed_companies
 
-def compare_yearly_dividends(conn, last_run_id, prev_run_id, diff_dir, timestamp):
+def compare_yearly_dividends(conn, last_run_id, prev_run_id, writer):
     """Сравнивает годовые дивиденды между двумя запусками"""
-    # Получаем годовые дивиденды из последнего запуска
-    last_dividends_query = f"""
-    SELECT c.ticker, yd.year, yd.total_amount
-    FROM yearly_dividends yd
-    JOIN companies c ON yd.company_id = c.id
-    WHERE c.parsing_run_id = {last_run_id}
-    """
-    
-    # Получаем годовые дивиденды из предыдущего запуска
-    prev_dividends_query = f"""
-    SELECT c.ticker, yd.year, yd.total_amount
-    FROM yearly_dividends yd
-    JOIN companies c ON yd.company_id = c.id
-    WHERE c.parsing_run_id = {prev_run_id}
-    """
+    params = run_pair_params(last_run_id, prev_run_id)
     
-    last_dividends = pd.read_sql_query(last_dividends_query, conn)
-    prev_dividends = pd.read_sql_query(prev_dividends_query, conn)
+    # Годовые дивиденды из последнего запуска и из последних успешных наблюдений компаний
+    last_dividends = pd.read_sql_query(LAST_DIVIDENDS_QUERY, conn, params=params)
+    prev_dividends = pd.read_sql_query(PREV_DIVIDENDS_QUERY, conn, params=params)
     
     # Создаем уникальные ключи для сравнения
     last_dividends['dividend_key'] = last_dividends['ticker'] + '_' + last_dividends['year'].astype(str)
@@ -133,19 +518,15 @@ def compare_yearly_dividends(conn, last_run_id, prev_run_id, diff_dir, timestamp
     removed_dividends = prev_dividends[~prev_dividends['dividend_key'].isin(last_dividends['dividend_key'])]
     
     # Создаем словари для быстрого поиска сумм годовых дивидендов
-    last_dict = {row['dividend_key']: row for _, row in last_dividends.iterrows()}
-    prev_dict = {row['dividend_key']: row for _, row in prev_dividends.iterrows()}
-    
-    # Находим общие ключи
-    common_keys = set(last_dict.keys()) & set(prev_dict.keys())
+    last_dict = {row['dividend_key']: row for row in last_dividends.to_dict('records')}
+    prev_dict = {row['dividend_key']: row for row in prev_dividends.to_dict('records')}
     
-    # Находим годовые дивиденды с изменениями в суммах
+    # Находим годовые дивиденды с изменениями в суммах (в порядке последнего запуска)
     changed_rows = []
-    for key in common_keys:
-        last_row = last_dict[key]
-        prev_row = prev_dict[key]
+    for key, last_row in last_dict.items():
+        prev_row = prev_dict.get(key)
         
-        if last_row['total_amount'] != prev_row['total_amount']:
+        if prev_row is not None and last_row['total_amount'] != prev_row['total_amount']:
             changed_rows.append({
                 'ticker': last_row['ticker'],
                 'year': last_row['year'],
@@ -155,66 +536,19 @@ def compare_yearly_dividends(conn, last_run_id, prev_run_id, diff_dir, timestamp
     
     changed_dividends = pd.DataFrame(changed_rows)
     
-    # Формируем отчет
-    with open(os.path.join(diff_dir, f"yearly_dividends_diff_{timestamp}.txt"), 'w', encoding='utf-8') as f:
-        f.write(f"Отчет по изменениям в годовых дивидендах между запусками {prev_run_id} и {last_run_id}\n")
-        f.write("=" * 80 + "\n\n")
-        
-        f.write("НОВЫЕ ГОДОВЫЕ ДИВИДЕНДЫ:\n")
-        f.write("-" * 80 + "\n")
-        if len(new_dividends) == 0:
-            f.write("Нет новых данных о годовых дивидендах\n")
-        else:
-            for _, row in new_dividends.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Год: {row['year']}\n")
-                f.write(f"Сумма: {row['total_amount']}\n")
-                f.write("-" * 40 + "\n")
-        f.write("\n")
-        
-        f.write("УДАЛЕННЫЕ ГОДОВЫЕ ДИВИДЕНДЫ:\n")
-        f.write("-" * 80 + "\n")
-        if len(removed_dividends) == 0:
-            f.write("Нет удаленных данных о годовых дивидендах\n")
-        else:
-            for _, row in removed_dividends.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Год: {row['year']}\n")
-                f.write(f"Сумма: {row['total_amount']}\n")
-                f.write("-" * 40 + "\n")
-        f.write("\n")
-        
-        f.write("ИЗМЕНЕННЫЕ ГОДОВЫЕ ДИВИДЕНДЫ:\n")
-        f.write("-" * 80 + "\n")
-        if len(changed_dividends) == 0:
-            f.write("Нет измененных данных о годовых дивидендах\n")
-        else:
-            for _, row in changed_dividends.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Год: {row['year']}\n")
-                f.write(f"Старая сумма: {row['total_amount_prev']}\n")
-                f.write(f"Новая сумма: {row['total_amount_last']}\n")
-                f.write("-" * 40 + "\n")
+    writer.add_frame('yearly_dividends', 'new', new_dividends)
+    writer.add_frame('yearly_dividends', 'removed', removed_dividends)
+    writer.add_frame('yearly_dividends', 'changed', changed_dividends)
     
     return new_dividends, removed_dividends, changed_dividends
 
-def compare_dividend_payments(conn, last_run_id, prev_run_id, diff_dir, timestamp):
+def compare_dividend_payments(conn, last_run_id, prev_run_id, writer):
     """Сравнивает выплаты дивидендов между двумя запусками"""
-    # Получаем выплаты из последнего запуска
-    last_payments_query = f"""
-    SELECT c.ticker, dp.year, dp.amount, dp.cutoff_date, dp.payment_date
-    FROM dividend_payments dp
-    JOIN companies c ON dp.company_id = c.id
-    WHERE c.parsing_run_id = {last_run_id}
-    """
+    params = run_pair_params(last_run_id, prev_run_id)
     
-    # Получаем выплаты из предыдущего запуска
-    prev_payments_query = f"""
-    SELECT c.ticker, dp.year, dp.amount, dp.cutoff_date, dp.payment_date
-    FROM dividend_payments dp
-    JOIN companies c ON dp.company_id = c.id
-    WHERE c.parsing_run_id = {prev_run_id}
-    """
-    
-    last_payments = pd.read_sql_query(last_payments_query, conn)
-    prev_payments = pd.read_sql_query(prev_payments_query, conn)
+    # Выплаты из последнего запуска и из последних успешных наблюдений компаний
+    last_payments = pd.read_sql_query(LAST_PAYMENTS_QUERY, conn, params=params)
+    prev_payments = pd.read_sql_query(PREV_PAYMENTS_QUERY, conn, params=params)
     
     # Создаем уникальные ключи для сравнения (без суммы выплаты)
     last_payments['payment_key'] = last_payments['ticker'] + '_' + last_payments['year'].astype(str) + '_' + last_payments['cutoff_date'] + '_' + last_payments['payment_date']
@@ -227,19 +561,15 @@ def compare_dividend_payments(conn, last_run_id, prev_run_id, diff_dir, timestam
     removed_payments = prev_payments[~prev_payments['payment_key'].isin(last_payments['payment_key'])]
     
     # Создаем словари для быстрого поиска сумм выплат
-    last_dict = {row['payment_key']: row for _, row in last_payments.iterrows()}
-    prev_dict = {row['payment_key']: row for _, row in prev_payments.iterrows()}
-    
-    # Находим общие ключи
-    common_keys = set(last_dict.keys()) & set(prev_dict.keys())
+    last_dict = {row['payment_key']: row for row in last_payments.to_dict('records')}
+    prev_dict = {row['payment_key']: row for row in prev_payments.to_dict('records')}
     
-    # Находим выплаты с изменениями в суммах
+    # Находим выплаты с изменениями в суммах (в порядке последнего запуска)
     changed_rows = []
-    for key in common_keys:
-        last_row = last_dict[key]
-        prev_row = prev_dict[key]
+    for key, last_row in last_dict.items():
+        prev_row = prev_dict.get(key)
         
-        if last_row['amount'] != prev_row['amount']:
+        if prev_row is not None and last_row['amount'] != prev_row['amount']:
             changed_rows.append({
                 'ticker': last_row['ticker'],
                 'year': last_row['year'],
@@ -251,79 +581,14 @@ def compare_dividend_payments(conn, last_run_id, prev_run_id, diff_dir, timestam
     
     changed_payments = pd.DataFrame(changed_rows)
     
-    # Формируем отчет
-    with open(os.path.join(diff_dir, f"dividend_payments_diff_{timestamp}.txt"), 'w', encoding='utf-8') as f:
-        f.write(f"Отчет по изменениям в выплатах дивидендов между запусками {prev_run_id} и {last_run_id}\n")
-        f.write("=" * 80 + "\n\n")
-        
-        f.write("НОВЫЕ ВЫПЛАТЫ:\n")
-        f.write("-" * 80 + "\n")
-        if len(new_payments) == 0:
-            f.write("Нет новых выплат\n")
-        else:
-            for _, row in new_payments.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Год: {row['year']}\n")
-                f.write(f"Размер: {row['amount']}\n")
-                f.write(f"Дата отсечки: {row['cutoff_date']}\n")
-                f.write(f"Дата выплаты: {row['payment_date']}\n")
-                f.write("-" * 40 + "\n")
-        f.write("\n")
-        
-        f.write("УДАЛЕННЫЕ ВЫПЛАТЫ:\n")
-        f.write("-" * 80 + "\n")
-        if len(removed_payments) == 0:
-            f.write("Нет удаленных выплат\n")
-        else:
-            for _, row in removed_payments.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Год: {row['year']}\n")
-                f.write(f"Размер: {row['amount']}\n")
-                f.write(f"Дата отсечки: {row['cutoff_date']}\n")
-                f.write(f"Дата выплаты: {row['payment_date']}\n")
-                f.write("-" * 40 + "\n")
-        f.write("\n")
-        
-        f.write("ИЗМЕНЕННЫЕ ВЫПЛАТЫ:\n")
-        f.write("-" * 80 + "\n")
-        if len(changed_payments) == 0:
-            f.write("Нет измененных выплат\n")
-        else:
-            for _, row in changed_payments.iterrows():
-                f.write(f"Тикер: {row['ticker']}, Год: {row['year']}\n")
-                f.write(f"Дата отсечки: {row['cutoff_date']}, Дата выплаты: {row['payment_date']}\n")
-                f.write(f"Старый размер: {row['amount_prev']}\n")
-                f.write(f"Новый размер: {row['amount_last']}\n")
-                f.write("-" * 40 + "\n")
+    writer.add_frame('dividend_payments', 'new', new_payments)
+    writer.add_frame('dividend_payments', 'removed', removed_payments)
+    writer.add_frame('dividend_payments', 'changed', changed_payments)
     
     return new_payments, removed_payments, changed_payments
 
-def create_summary_report(last_run_id, prev_run_id, diff_dir, timestamp, 
-                         new_companies, removed_companies, changed_companies,
-                         dividend_differences, 
-                         new_payments, removed_payments, changed_payments):
+def create_summary_report(summary_file, last_run_id, prev_run_id, writer, files):
     """Создает сводный отчет по всем изменениям"""
-    file_prefix = f"iter_{prev_run_id}_{last_run_id}_"
-    
-    # Пути к файлам
-    companies_file = os.path.join(diff_dir, f"{file_prefix}companies_diff_{timestamp}.txt")
-    yearly_dividends_file = os.path.join(diff_dir, f"{file_prefix}yearly_dividends_diff_{timestamp}.txt")
-    dividend_payments_file = os.path.join(diff_dir, f"{file_prefix}dividend_payments_diff_{timestamp}.txt")
-    summary_file = os.path.join(diff_dir, f"{file_prefix}summary_diff_{timestamp}.txt")
-    
-    # Переименовываем уже созданные файлы
-    os.rename(os.path.join(diff_dir, f"companies_diff_{timestamp}.txt"), companies_file)
-    os.rename(os.path.join(diff_dir, f"yearly_dividends_diff_{timestamp}.txt"), yearly_dividends_file)
-    os.rename(os.path.join(diff_dir, f"dividend_payments_diff_{timestamp}.txt"), dividend_payments_file)
-    
-    # Распаковываем информацию о дивидендах
-    if isinstance(dividend_differences, tuple) and len(dividend_differences) == 3:
-        new_dividends, removed_dividends, changed_dividends = dividend_differences
-    else:
-        # Для обратной совместимости
-        new_dividends = pd.DataFrame()
-        removed_dividends = pd.DataFrame()
-        changed_dividends = dividend_differences
-    
-    # Создаем сводный отчет
     with open(summary_file, 'w', encoding='utf-8') as f:
         f.write(f"СВОДНЫЙ ОТЧЕТ ПО ИЗМЕНЕНИЯМ МЕЖДУ ЗАПУСКАМИ {prev_run_id} И {last_run_id}\n")
         f.write("=" * 80 + "\n\n")
@@ -331,31 +596,29 @@ def create_summary_report(last_run_id, prev_run_id, diff_dir, timestamp,
         # Изменения в компаниях
         f.write("КОМПАНИИ:\n")
         f.write("-" * 80 + "\n")
-        f.write(f"Новые компании: {len(new_companies)}\n")
-        f.write(f"Удаленные компании: {len(removed_companies)}\n")
-        f.write(f"Измененные компании: {len(changed_companies)}\n")
+        f.write(f"Новые компании: {writer.count('companies', 'new')}\n")
+        f.write(f"Удаленные компании: {writer.count('companies', 'removed')}\n")
+        f.write(f"Измененные компании: {writer.count('companies', 'changed')}\n")
         f.write("\n")
         
         # Изменения в годовых дивидендах
         f.write("ГОДОВЫЕ ДИВИДЕНДЫ:\n")
         f.write("-" * 80 + "\n")
-        f.write(f"Новые годовые дивиденды: {len(new_dividends)}\n")
-        f.write(f"Удаленные годовые дивиденды: {len(removed_dividends)}\n")
-        f.write(f"Измененные годовые дивиденды: {len(changed_dividends)}\n")
+        f.write(f"Новые годовые дивиденды: {writer.count('yearly_dividends', 'new')}\n")
+        f.write(f"Удаленные годовые дивиденды: {writer.count('yearly_dividends', 'removed')}\n")
+        f.write(f"Измененные годовые дивиденды: {writer.count('yearly_dividends', 'changed')}\n")
         f.write("\n")
         
         # Изменения в выплатах
         f.write("ВЫПЛАТЫ ДИВИДЕНДОВ:\n")
         f.write("-" * 80 + "\n")
-        f.write(f"Новые выплаты: {len(new_payments)}\n")
-        f.write(f"Удаленные выплаты: {len(removed_payments)}\n")
-        f.write(f"Измененные выплаты: {len(changed_payments)}\n")
+        f.write(f"Новые выплаты: {writer.count('dividend_payments', 'new')}\n")
+        f.write(f"Удаленные выплаты: {writer.count('dividend_payments', 'removed')}\n")
+        f.write(f"Измененные выплаты: {writer.count('dividend_payments', 'changed')}\n")
         f.write("\n")
         
         # Общее количество изменений
-        total_changes = (len(new_companies) + len(removed_companies) + len(changed_companies) + 
-                         len(new_dividends) + len(removed_dividends) + len(changed_dividends) + 
-                         len(new_payments) + len(removed_payments) + len(changed_payments))
+        total_changes = sum(writer.count(entity) for entity in REPORT_SECTIONS)
         
         f.write("ИТОГО:\n")
         f.write("-" * 80 + "\n")
@@ -363,72 +626,254 @@ def create_summary_report(last_run_id, prev_run_id, diff_dir, timestamp,
         
     return {
         'summary_file': summary_file,
-        'companies_file': companies_file,
-        'yearly_dividends_file': yearly_dividends_file,
-        'dividend_payments_file': dividend_payments_file,
+        'companies_file': files['companies'],
+        'yearly_dividends_file': files['yearly_dividends'],
+        'dividend_payments_file': files['dividend_payments'],
         'has_differences': total_changes > 0
     }
 
-def main():
-    """Основная функция для запуска сравнения"""
-    # Создаем директорию для отчетов
-    diff_dir = ensure_diff_dir_exists()
-    
-    # Подключаемся к базе данных
-    conn = sqlite3.connect(DB_PATH)
-    
-    # Получаем ID последних двух запусков
-    last_run_id, prev_run_id, timestamp = get_last_two_run_ids(conn)
-    
-    if not last_run_id or not prev_run_id:
-        print("Недостаточно запусков для сравнения (нужно минимум 2)")
-        return {
-            'has_differences': False,
-            'files': {}
-        }
-    
-    print(f"Сравниваем запуски {prev_run_id} и {last_run_id}")
-    
-    # Сравниваем компании
-    print("Сравниваем компании...")
-    new_companies, removed_companies, changed_companies = compare_companies(
-        conn, last_run_id, prev_run_id, diff_dir, timestamp
-    )
+def compare_runs(conn, last_run_id, prev_run_id, sink):
+    """Сравнивает два запуска, передавая записи о различиях в sink по мере их нахождения"""
+    compare_companies(conn, last_run_id, prev_run_id, sink)
+    compare_yearly_dividends(conn, last_run_id, prev_run_id, sink)
+    compare_dividend_payments(conn, last_run_id, prev_run_id, sink)
+
+def compute_diff(conn, last_run_id, prev_run_id):
+    """Сравнивает два запуска и возвращает список записей о различиях"""
+    collector = DiffRecordCollector()
+    compare_runs(conn, last_run_id, prev_run_id, collector)
+    return collector.records
+
+def find_cached_pair(conn, last_run_id, prev_run_id):
+    """Возвращает (id, количество различий) сохраненной пары запусков или None"""
+    # Пара с total_changes = NULL еще записывается (см. DiffTableSink)
+    return conn.execute(
+        "SELECT id, total_changes FROM diff_pairs "
+        "WHERE prev_run_id = ? AND last_run_id = ? AND total_changes IS NOT NULL",
+        (prev_run_id, last_run_id)
+    ).fetchone()
+
+def iter_cached_records(conn, diff_pair_id):
+    """Читает сохраненные записи о различиях пары запусков по одной"""
+    for (payload,) in conn.execute(
+        "SELECT payload FROM diff_records WHERE diff_pair_id = ? ORDER BY id", (diff_pair_id,)
+    ):
+        yield json.loads(payload)
+
+def load_cached_diff(conn, last_run_id, prev_run_id):
+    """Возвращает сохраненные записи о различиях пары запусков или None"""
+    pair = find_cached_pair(conn, last_run_id, prev_run_id)
+    if pair is None:
+        return None
+    return list(iter_cached_records(conn, pair[0]))
+
+def can_store_diff(conn, last_run_id):
+    """Проверяет, можно ли сохранить сравнение с запуском в diff_records"""
+    # Незавершенный запуск еще может измениться, его сравнение не кэшируем
+    status = conn.execute("SELECT status FROM parsing_runs WHERE id = ?", (last_run_id,)).fetchone()
+    return DIFF_STORE_RECORDS and status is not None and status[0] != 'running'
+
+def store_diff(conn, last_run_id, prev_run_id, records):
+    """Сохраняет записи о различиях пары запусков в базу данных"""
+    if not can_store_diff(conn, last_run_id):
+        return
+    
+    with conn:
+        _delete_incomplete_pair(conn, last_run_id, prev_run_id)
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO diff_pairs (prev_run_id, last_run_id, total_changes, computed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (prev_run_id, last_run_id, len(records), datetime.now())
+        )
+        if cursor.rowcount == 0:
+            # Пару уже сохранил другой процесс
+            return
+        _insert_records(conn, cursor.lastrowid, records)
+
+def _compute_diff_worker(db_path, last_run_id, prev_run_id):
+    """Вычисляет сравнение пары запусков в отдельном процессе"""
+    conn = db_access.connect_readonly(db_path)
+    try:
+        return compute_diff(conn, last_run_id, prev_run_id)
+    finally:
+        conn.close()
+
+def get_run_pairs(conn, first_run_id, last_run_id):
+    """Возвращает пары соседних запусков (prev_run_id, last_run_id) в диапазоне"""
+    run_ids = [
+        run_id for (run_id,) in conn.execute(
+            "SELECT id FROM parsing_runs WHERE id BETWEEN ? AND ? ORDER BY id",
+            (first_run_id, last_run_id)
+        )
+    ]
+    return list(zip(run_ids, run_ids[1:]))
+
+def get_diff_range(conn, first_run_id, last_run_id, db_path=DB_PATH, workers=DIFF_WORKERS):
+    """Возвращает записи о различиях для всех пар соседних запусков в диапазоне.
+
+    Сохраненные пары берутся из кэша, остальные вычисляются параллельно
+    в отдельных процессах и сохраняются в базу данных.
+    """
+    results = {}
+    missing = []
+    for prev_run_id, next_run_id in get_run_pairs(conn, first_run_id, last_run_id):
+        records = load_cached_diff(conn, next_run_id, prev_run_id)
+        if records is None:
+            missing.append((prev_run_id, next_run_id))
+        else:
+            results[(prev_run_id, next_run_id)] = records
+    
+    if len(missing) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                pair: executor.submit(_compute_diff_worker, db_path, pair[1], pair[0])
+                for pair in missing
+            }
+            computed = {pair: future.result() for pair, future in futures.items()}
+    else:
+        with db_access.reader(db_path) as reader:
+            computed = {pair: compute_diff(reader, pair[1], pair[0]) for pair in missing}
     
-    # Сравниваем годовые дивиденды
-    print("Сравниваем годовые дивиденды...")
-    dividend_differences = compare_yearly_dividends(
-        conn, last_run_id, prev_run_id, diff_dir, timestamp
-    )
+    # Запись в базу выполняет только основной процесс
+    for (prev_run_id, next_run_id), records in computed.items():
+        store_diff(conn, next_run_id, prev_run_id, records)
+        results[(prev_run_id, next_run_id)] = records
     
-    # Сравниваем выплаты дивидендов
-    print("Сравниваем выплаты дивидендов...")
-    new_payments, removed_payments, changed_payments = compare_dividend_payments(
-        conn, last_run_id, prev_run_id, diff_dir, timestamp
+    return dict(sorted(results.items()))
+
+def find_existing_reports(diff_dir, last_run_id, prev_run_id):
+    """Находит последние сформированные отчеты по паре запусков"""
+    file_prefix = os.path.join(diff_dir, f"iter_{prev_run_id}_{last_run_id}_")
+    summaries = sorted(glob.glob(f"{file_prefix}summary_diff_*.txt"))
+    if not summaries:
+        return None
+    
+    timestamp = summaries[-1][len(f"{file_prefix}summary_diff_"):-len(".txt")]
+    files = {
+        name: f"{file_prefix}{name}_diff_{timestamp}.txt"
+        for name in ('summary', 'companies', 'yearly_dividends', 'dividend_payments')
+    }
+    if not all(os.path.exists(path) for path in files.values()):
+        return None
+    for name in STREAM_FORMATS:
+        path = f"{file_prefix}records_{timestamp}.{name}"
+        if os.path.exists(path):
+            files[name] = path
+    return files
+
+def write_diff_reports(diff_dir, last_run_id, prev_run_id, records, timestamp=None):
+    """Формирует текстовые отчеты из записей о различиях"""
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+    writer = DiffReportWriter(diff_dir, last_run_id, prev_run_id, timestamp)
+    try:
+        for record in records:
+            writer.add(record)
+    except Exception:
+        writer.discard()
+        raise
+    return format_result(writer.close())
+
+def analyze_pair(conn, diff_dir, last_run_id, prev_run_id, timestamp=None):
+    """Возвращает отчеты по паре запусков, используя сохраненные результаты, если они есть"""
+    pair = find_cached_pair(conn, last_run_id, prev_run_id)
+    if pair is not None:
+        diff_pair_id, total_changes = pair
+        files = find_existing_reports(diff_dir, last_run_id, prev_run_id)
+        if files is not None:
+            print(f"Отчеты по запускам {prev_run_id} и {last_run_id} уже сформированы")
+            return {'has_differences': total_changes > 0, 'files': files}
+        print(f"Используем сохраненные результаты сравнения запусков {prev_run_id} и {last_run_id}")
+        print("Создаем отчеты...")
+        with db_access.reader() as reader:
+            return write_diff_reports(
+                diff_dir, last_run_id, prev_run_id, iter_cached_records(reader, diff_pair_id), timestamp
+            )
+    
+    # Записи сразу пакетами уходят в отчеты и diff_records, не накапливаясь в памяти
+    print("Сравниваем компании, годовые дивиденды и выплаты и создаем отчеты...")
+    writer = DiffReportWriter(
+        diff_dir, last_run_id, prev_run_id, timestamp or datetime.now().strftime("%Y%m%d_%H%M%S"),
+        table_conn=conn if can_store_diff(conn, last_run_id) else None
     )
+    try:
+        with db_access.reader() as reader:
+            compare_runs(reader, last_run_id, prev_run_id, writer)
+    except Exception:
+        writer.discard()
+        raise
+    return format_result(writer.close())
+
+def analyze_range(first_run_id, last_run_id, workers=DIFF_WORKERS):
+    """Формирует отчеты по всем парам соседних запусков в диапазоне"""
+    diff_dir = ensure_diff_dir_exists()
+    conn = sql_functions.connect(DB_PATH)
+    try:
+        diffs = get_diff_range(conn, first_run_id, last_run_id, workers=workers)
+        results = {}
+        for (prev_run_id, next_run_id), records in diffs.items():
+            files = find_existing_reports(diff_dir, next_run_id, prev_run_id)
+            if files is not None:
+                results[(prev_run_id, next_run_id)] = {'has_differences': len(records) > 0, 'files': files}
+            else:
+                results[(prev_run_id, next_run_id)] = write_diff_reports(
+                    diff_dir, next_run_id, prev_run_id, records
+                )
+    finally:
+        conn.close()
+    
+    return results
+
+def main(prev_run_id=None, last_run_id=None):
+    """Основная функция для запуска сравнения (по умолчанию - двух последних запусков)"""
+    # Создаем директорию для отчетов
+    diff_dir = ensure_diff_dir_exists()
     
-    # Создаем сводный отчет
-    print("Создаем сводный отчет...")
-    result = create_summary_report(
-        last_run_id, prev_run_id, diff_dir, timestamp,
-        new_companies, removed_companies, changed_companies,
-        dividend_differences,
-        new_payments, removed_payments, changed_payments
-    )
+    # Подключаемся к базе данных
+    conn = sql_functions.connect(DB_PATH)
     
-    # Закрываем соединение с базой данных
-    conn.close()
+    try:
+        if prev_run_id is None or last_run_id is None:
+            # Получаем ID последних двух запусков
+            last_run_id, prev_run_id, timestamp = get_last_two_run_ids(conn)
+        else:
+            found = {run_id for (run_id,) in conn.execute(
+                "SELECT id FROM parsing_runs WHERE id IN (?, ?)", (prev_run_id, last_run_id)
+            )}
+            if found != {prev_run_id, last_run_id} or prev_run_id >= last_run_id:
+                raise ValueError(f"Некорректная пара запусков: {prev_run_id} и {last_run_id}")
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        
+        if not last_run_id or not prev_run_id:
+            print("Недостаточно запусков для сравнения (нужно минимум 2)")
+            return {
+                'has_differences': False,
+                'files': {}
+            }
+        
+        print(f"Сравниваем запуски {prev_run_id} и {last_run_id}")
+        result = analyze_pair(conn, diff_dir, last_run_id, prev_run_id, timestamp)
+    finally:
+        # Закрываем соединение с базой данных
+        conn.close()
     
     print(f"Анализ завершен. Отчеты сохранены в директории '{diff_dir}'")
     
+    return result
+
+def format_result(result):
+    """Приводит результат формирования отчетов к виду, возвращаемому main()"""
+    files = {
+        'summary': result['summary_file'],
+        'companies': result['companies_file'],
+        'yearly_dividends': result['yearly_dividends_file'],
+        'dividend_payments': result['dividend_payments_file']
+    }
+    for name in STREAM_FORMATS:
+        if f'{name}_file' in result:
+            files[name] = result[f'{name}_file']
     return {
         'has_differences': result['has_differences'],
-        'files': {
-            'summary': result['summary_file'],
-            'companies': result['companies_file'],
-            'yearly_dividends': result['yearly_dividends_file'],
-            'dividend_payments': result['dividend_payments_file']
-        }
+        'files': files
     }
 
 if __name__ == "__main__":
@@ -438,4 +883,4 @@ if __name__ == "__main__":
     if result['has_differences']:
         print("Обнаружены расхождения между запусками.")
     else:
-        print("Расхождений между запусками не обнаружено.") 
\ No newline at end of file
+        print("Расхождений между запусками не обнаружено.")
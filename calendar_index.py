@@ -0,0 +1,169 @@
+import sys
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from typing import List, Dict, Optional, Union
+from config import DB_PATH
+import db_access
+from db_access import SNAPSHOT_CTE, LISTED_TICKERS
+import database  # Создает таблицу dividend_calendar в старых базах
+
+CALENDAR_COLUMNS = ['event_date', 'event_type', 'ticker', 'name', 'sector', 'year', 'amount', 'amount_value']
+
+# События (отсечки и выплаты) из строк выплат компаний, отобранных CTE selected
+EVENTS_SELECT = """
+SELECT ru_date(dp.cutoff_date), 'cutoff', c.ticker, c.name, c.sector, dp.year,
+       dp.amount, ru_amount(dp.amount), c.parsing_run_id
+FROM dividend_payments dp
+JOIN selected c ON dp.company_id = c.id
+WHERE ru_date(dp.cutoff_date) IS NOT NULL
+UNION ALL
+SELECT ru_date(dp.payment_date), 'payment', c.ticker, c.name, c.sector, dp.year,
+       dp.amount, ru_amount(dp.amount), c.parsing_run_id
+FROM dividend_payments dp
+JOIN selected c ON dp.company_id = c.id
+WHERE ru_date(dp.payment_date) IS NOT NULL
+"""
+
+INSERT_EVENTS = """
+INSERT INTO dividend_calendar
+    (event_date, event_type, ticker, name, sector, year, amount, amount_value, parsing_run_id)
+"""
+
+def rebuild_calendar(conn) -> int:
+    """Полностью перестраивает календарь по снимку последнего запуска.
+
+    В календарь попадают только тикеры из списка на сайте в этом запуске
+    (для каждого - последнее успешное наблюдение, см. db_access.SNAPSHOT_CTE).
+    """
+    row = conn.execute("SELECT MAX(id) FROM parsing_runs").fetchone()
+    with conn:
+        conn.execute("DELETE FROM dividend_calendar")
+        if row[0] is None:
+            return 0
+        cursor = conn.execute(INSERT_EVENTS + SNAPSHOT_CTE + """
+        , selected AS (
+            SELECT * FROM snapshot
+        )
+        """ + EVENTS_SELECT, {'run_id': row[0]})
+    return cursor.rowcount
+
+def refresh_calendar(conn, run_id: int) -> int:
+    """Обновляет календарь после запуска.
+
+    Заменяет события обработанных в запуске тикеров и удаляет события тикеров,
+    которых больше нет в списке на сайте. События пропущенных тикеров остаются.
+    """
+    if conn.execute("SELECT 1 FROM dividend_calendar LIMIT 1").fetchone() is None:
+        return rebuild_calendar(conn)
+
+    with conn:
+        conn.execute(
+            """
+            DELETE FROM dividend_calendar
+            WHERE ticker IN (SELECT ticker FROM companies WHERE parsing_run_id = :run_id)
+               OR ticker NOT IN (""" + LISTED_TICKERS + """)
+            """,
+            {'run_id': run_id}
+        )
+        cursor = conn.execute(INSERT_EVENTS + """
+        WITH selected AS (
+            SELECT * FROM companies WHERE parsing_run_id = :run_id
+        )
+        """ + EVENTS_SELECT, {'run_id': run_id})
+    return cursor.rowcount
+
+def _iso(value: Union[date, str, None]) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat()
+
+class DividendCalendar:
+    """Отсортированный по дате календарь дивидендных событий.
+
+    События загружаются один раз в порядке индекса по event_date, все выборки
+    выполняются бинарным поиском по массиву дат. Объект рассчитан на многократные
+    запросы (загрузить один раз и переиспользовать); для разовой выборки
+    достаточно загрузить только нужный диапазон дат через load(start, end).
+    """
+
+    def __init__(self, events: List[Dict]):
+        self.events = events
+        self.dates = [event['event_date'] for event in events]
+        self._sectors = None
+
+    @classmethod
+    def load(cls, start: Union[date, str, None] = None, end: Union[date, str, None] = None,
+             db_path=DB_PATH) -> 'DividendCalendar':
+        """Загружает календарь из базы данных (по умолчанию - все события).
+
+        Границы диапазона дат выбираются по индексу event_date.
+        """
+        with db_access.reader(db_path) as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(CALENDAR_COLUMNS)} FROM dividend_calendar "
+                "WHERE event_date >= COALESCE(:start, '') AND event_date <= COALESCE(:end, '9999-12-31') "
+                "ORDER BY event_date, ticker",
+                {'start': _iso(start), 'end': _iso(end)}
+            ).fetchall()
+        return cls([dict(zip(CALENDAR_COLUMNS, row)) for row in rows])
+
+    @staticmethod
+    def _slice(dates: List[str], events: List[Dict], start, end, event_type) -> List[Dict]:
+        lo = bisect_left(dates, _iso(start)) if start is not None else 0
+        hi = bisect_right(dates, _iso(end)) if end is not None else len(dates)
+        selected = events[lo:hi]
+        if event_type is not None:
+            selected = [event for event in selected if event['event_type'] == event_type]
+        return selected
+
+    def window(self, start: Union[date, str, None], end: Union[date, str, None],
+               event_type: Optional[str] = None) -> List[Dict]:
+        """События с датой в диапазоне [start, end]"""
+        return self._slice(self.dates, self.events, start, end, event_type)
+
+    def next_n(self, n: int, from_date: Union[date, str, None] = None,
+               event_type: Optional[str] = None) -> List[Dict]:
+        """Ближайшие n событий начиная с from_date (по умолчанию с сегодняшнего дня)"""
+        start = bisect_left(self.dates, _iso(from_date or date.today()))
+        result = []
+        for event in self.events[start:]:
+            if len(result) >= n:
+                break
+            if event_type is None or event['event_type'] == event_type:
+                result.append(event)
+        return result
+
+    def sector_window(self, sector: str, start: Union[date, str, None], end: Union[date, str, None],
+                      event_type: Optional[str] = None) -> List[Dict]:
+        """События сектора с датой в диапазоне [start, end]"""
+        if self._sectors is None:
+            # Разбиение по секторам сохраняет сортировку по дате
+            self._sectors = {}
+            for event in self.events:
+                self._sectors.setdefault(event['sector'], []).append(event)
+            self._sectors = {
+                name: ([event['event_date'] for event in events], events)
+                for name, events in self._sectors.items()
+            }
+        dates, events = self._sectors.get(sector, ([], []))
+        return self._slice(dates, events, start, end, event_type)
+
+    def sectors(self) -> List[str]:
+        """Список секторов, по которым есть события"""
+        return sorted({event['sector'] for event in self.events if event['sector']})
+
+def print_upcoming(days: int) -> None:
+    """Выводит дивидендные события на ближайшие days дней"""
+    today = date.today()
+    end = today + timedelta(days=days)
+    events = DividendCalendar.load(today, end).window(today, end)
+    if not events:
+        print(f"Нет дивидендных событий в ближайшие {days} дней")
+        return
+    for event in events:
+        event_name = "Отсечка" if event['event_type'] == 'cutoff' else "Выплата"
+        print(f"{event['event_date']} {event_name}: {event['ticker']} ({event['name']}), "
+              f"{event['amount']}, Сектор: {event['sector']}")
+
+if __name__ == "__main__":
+    print_upcoming(int(sys.argv[1]) if len(sys.argv) > 1 else 30)
@@ -11,5 +11,45 @@ DB_PATH = Path("data/dividends.db")
 MAX_TICKERS_PER_RUN = None  # Без ограничений на количество тикеров
 REQUEST_DELAY = 3  # Задержка между запросами в секундах для продакшена
 
+# Настройки планировщика обхода
+SCHEDULER_HISTORY_RUNS = 10  # Сколько последних наблюдений тикера учитывать при оценке частоты изменений
+SCHEDULER_CALENDAR_HORIZON_DAYS = 30  # Окно (в днях) вокруг даты отсечки/выплаты, в котором тикер приоритетнее
+SCHEDULER_DEFAULT_CHANGE_RATE = 0.5  # Частота изменений для тикеров без истории наблюдений
+SCHEDULER_CHANGE_WEIGHT = 1.0
+SCHEDULER_CALENDAR_WEIGHT = 1.0
+SCHEDULER_STALENESS_WEIGHT = 0.5
+
+# Настройки подключений для чтения (анализ, отчеты, аналитика)
+READ_MMAP_SIZE = 256 * 1024 * 1024  # Сколько байт файла базы отображать в память
+READ_CACHE_SIZE_KB = 64 * 1024  # Размер кэша страниц одного подключения в КиБ
+READ_STATEMENT_CACHE = 256  # Сколько подготовленных запросов хранит одно подключение
+READ_POOL_SIZE = 4  # Сколько подключений для чтения держит пул
+
+# Настройки анализа различий
+DIFF_WORKERS = None  # Число процессов для сравнения нескольких пар запусков (None - по числу ядер)
+DIFF_OUTPUT_FORMATS = ('jsonl', 'parquet')  # Машиночитаемые отчеты в дополнение к текстовым (parquet требует pyarrow)
+DIFF_BATCH_SIZE = 1000  # Сколько записей о различиях накапливать перед записью в файл или базу
+DIFF_STORE_RECORDS = True  # Сохранять записи о различиях в таблицу diff_records (кэш сравнений)
+
+# Настройки аналитики
+ANALYTICS_WINDOW_YEARS = 5  # Длина окна (в годах) для CAGR, регулярности и стабильности выплат
+ANALYTICS_CACHE_DIR = Path("data/analytics")  # Кэш рассчитанных показателей по запускам
+
+# Настройки поиска компаний
+SEARCH_RESULTS_LIMIT = 10  # Максимальное количество результатов поиска
+
+# Настройки промежуточной базы запуска
+STAGING_DIR = Path("data/staging")  # Промежуточные базы запусков, удаляются после публикации
+STAGING_IN_MEMORY = False  # Хранить данные запуска до публикации в памяти вместо файла
+STAGING_BUSY_TIMEOUT = 30  # Сколько секунд ждать снятия блокировки основной базы при публикации
+STAGING_PUBLISH_RETRIES = 3  # Сколько раз пытаться опубликовать запуск, если основная база занята
+
+# Настройки хранения истории запусков
+RETENTION_KEEP_LAST = 10  # Сколько последних запусков хранить всегда
+RETENTION_KEEP_WEEKLY = 8  # Сколько недель хранить по одному запуску в неделю
+RETENTION_KEEP_MONTHLY = 12  # Сколько месяцев хранить по одному запуску в месяц
+RETENTION_BATCH_SIZE = 5000  # Размер пакета удаления строк из рабочих таблиц
+ARCHIVE_DIR = Path("data/archive")  # Каталог сжатых архивов удаленных запусков
+
 # Создаем директорию для данных если её нет
 DB_PATH.parent.mkdir(parents=True, exist_ok=True) 
\ No newline at end of file
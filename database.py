@@ -1,8 +1,10 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.schema import CreateIndex
 from datetime import datetime
 from config import DB_PATH
+from sql_functions import register_functions, EXPRESSION_INDEXES
 
 Base = declarative_base()
 
@@ -23,7 +25,7 @@ class Company(Base):
     ticker = Column(String)
     name = Column(String)
     sector = Column(String)
-    parsing_run_id = Column(Integer, ForeignKey('parsing_runs.id'))
+    parsing_run_id = Column(Integer, ForeignKey('parsing_runs.id'), index=True)
     parsed_at = Column(DateTime, default=datetime.now)
     
     # Создаем составной уникальный ключ из ticker и parsing_run_id
@@ -38,7 +40,7 @@ class YearlyDividend(Base):
     __tablename__ = 'yearly_dividends'
     
     id = Column(Integer, primary_key=True)
-    company_id = Column(Integer, ForeignKey('companies.id'))
+    company_id = Column(Integer, ForeignKey('companies.id'), index=True)
     year = Column(String)
     total_amount = Column(String)
     created_at = Column(DateTime, default=datetime.now)
@@ -47,14 +49,90 @@ class DividendPayment(Base):
     __tablename__ = 'dividend_payments'
     
     id = Column(Integer, primary_key=True)
-    company_id = Column(Integer, ForeignKey('companies.id'))
+    company_id = Column(Integer, ForeignKey('companies.id'), index=True)
     year = Column(String)
     amount = Column(String)
     cutoff_date = Column(String)
     payment_date = Column(String)
     created_at = Column(DateTime, default=datetime.now)
 
+class TickerObservation(Base):
+    __tablename__ = 'ticker_observations'
+    
+    id = Column(Integer, primary_key=True)
+    parsing_run_id = Column(Integer, ForeignKey('parsing_runs.id'), index=True)
+    ticker = Column(String)
+    # 'parsed' - страница обработана, 'skipped' - не хватило бюджета, 'failed' - ошибка
+    status = Column(String)
+    priority = Column(Float, nullable=True)
+    # Хэш распарсенных данных тикера, по нему определяется факт изменения страницы
+    content_hash = Column(String, nullable=True)
+    changed = Column(Boolean, nullable=True)
+    observed_at = Column(DateTime, default=datetime.now)
+
+class DiffPair(Base):
+    __tablename__ = 'diff_pairs'
+    
+    id = Column(Integer, primary_key=True)
+    prev_run_id = Column(Integer, ForeignKey('parsing_runs.id'))
+    last_run_id = Column(Integer, ForeignKey('parsing_runs.id'))
+    total_changes = Column(Integer, default=0)
+    computed_at = Column(DateTime, default=datetime.now)
+    
+    __table_args__ = (
+        # Результат сравнения пары запусков хранится в одном экземпляре
+        UniqueConstraint('prev_run_id', 'last_run_id', name='unique_diff_pair'),
+    )
+
+class DiffRecord(Base):
+    __tablename__ = 'diff_records'
+    
+    id = Column(Integer, primary_key=True)
+    diff_pair_id = Column(Integer, ForeignKey('diff_pairs.id'), index=True)
+    entity = Column(String)  # 'companies', 'yearly_dividends', 'dividend_payments'
+    change = Column(String)  # 'new', 'removed', 'changed'
+    ticker = Column(String)
+    payload = Column(String)  # Запись о различии в формате JSON
+
+class CalendarEvent(Base):
+    __tablename__ = 'dividend_calendar'
+    
+    id = Column(Integer, primary_key=True)
+    event_date = Column(String, index=True)  # ISO-дата ГГГГ-ММ-ДД, сортируется как дата
+    event_type = Column(String)  # 'cutoff' - дата отсечки, 'payment' - дата выплаты
+    ticker = Column(String, index=True)
+    name = Column(String)
+    sector = Column(String)
+    year = Column(String)
+    amount = Column(String)
+    amount_value = Column(Float, nullable=True)
+    parsing_run_id = Column(Integer, ForeignKey('parsing_runs.id'))
+    
+    __table_args__ = (
+        Index('ix_dividend_calendar_sector_event_date', 'sector', 'event_date'),
+    )
+
 # Создаем подключение к базе данных
 engine = create_engine(f'sqlite:///{DB_PATH}')
+
+@event.listens_for(engine, 'connect')
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настраивает каждое новое подключение к SQLite"""
+    # Действует только для новой базы; существующая переводится в этот режим
+    # при первом сжатии (см. retention.compact_database)
+    dbapi_connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    # Функции ru_amount/ru_date нужны для индексов по выражениям при любой записи в таблицы
+    register_functions(dbapi_connection)
+
 Base.metadata.create_all(engine)
+
+# create_all не добавляет индексы в уже существующие таблицы, создаем недостающие.
+# IF NOT EXISTS вместо checkfirst: отражение схемы не поддерживает индексы по выражениям
+with engine.begin() as connection:
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+    for statement in EXPRESSION_INDEXES:
+        connection.exec_driver_sql(statement)
+
 Session = sessionmaker(bind=engine) 
\ No newline at end of file
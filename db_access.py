@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List
+from config import DB_PATH, READ_MMAP_SIZE, READ_CACHE_SIZE_KB, READ_STATEMENT_CACHE, READ_POOL_SIZE
+import sql_functions
+
+def listed_tickers(run_param: str = 'run_id') -> str:
+    """Выборка тикеров, которые были в списке на сайте в запуске :run_param
+    (обработанных, пропущенных и с ошибкой обработки)"""
+    return f"""
+    SELECT ticker FROM companies WHERE parsing_run_id = :{run_param}
+    UNION
+    SELECT ticker FROM ticker_observations WHERE parsing_run_id = :{run_param}
+"""
+
+def snapshot_cte(run_param: str = 'run_id') -> str:
+    """CTE snapshot: последнее успешное наблюдение (строка companies) каждого тикера,
+    который был в списке на сайте в запуске :run_param"""
+    return f"""
+WITH listed AS ({listed_tickers(run_param)}),
+latest AS (
+    SELECT c.ticker, MAX(c.parsing_run_id) AS run_id
+    FROM companies c
+    JOIN listed l ON l.ticker = c.ticker
+    WHERE c.parsing_run_id <= :{run_param}
+    GROUP BY c.ticker
+),
+snapshot AS (
+    SELECT c.*
+    FROM companies c
+    JOIN latest l ON l.ticker = c.ticker AND l.run_id = c.parsing_run_id
+)
+"""
+
+# Снимок запуска с параметром :run_id (анализ, календарь и поиск)
+SNAPSHOT_CTE = snapshot_cte()
+LISTED_TICKERS = listed_tickers()
+
+def connect_readonly(db_path=DB_PATH) -> sqlite3.Connection:
+    """Открывает подключение только для чтения, настроенное на быстрые выборки.
+
+    Файл открывается в режиме mode=ro и дополнительно защищен PRAGMA query_only,
+    страницы читаются через mmap, кэш страниц увеличен. Запросы с параметрами
+    вместо подставленных значений берутся из кэша подготовленных запросов.
+    """
+    uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+    conn = sqlite3.connect(
+        uri, uri=True, cached_statements=READ_STATEMENT_CACHE, check_same_thread=False
+    )
+    conn.execute('PRAGMA query_only = ON')
+    conn.execute(f'PRAGMA mmap_size = {int(READ_MMAP_SIZE)}')
+    conn.execute(f'PRAGMA cache_size = -{int(READ_CACHE_SIZE_KB)}')
+    sql_functions.register_functions(conn)
+    return conn
+
+class ReadPool:
+    """Небольшой пул подключений только для чтения.
+
+    Подключение берется из пула на время выборки и возвращается обратно, поэтому
+    прогретые кэш страниц и подготовленные запросы переиспользуются. Несколько
+    потоков читают одновременно через разные подключения.
+    """
+
+    def __init__(self, db_path=DB_PATH, size: int = READ_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self) -> None:
+        # Подключения SQLite нельзя использовать в дочернем процессе
+        if self._pid != os.getpid():
+            self._idle = []
+            self._lock = threading.Lock()
+            self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Выдает подключение из пула (или новое, если свободных нет)"""
+        self._reset_after_fork()
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = connect_readonly(self.db_path)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                if len(self._idle) < self.size and self._pid == os.getpid():
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    def close(self) -> None:
+        """Закрывает свободные подключения"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+_pools: Dict[str, ReadPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path=DB_PATH) -> ReadPool:
+    """Возвращает общий пул подключений для чтения базы"""
+    key = str(Path(db_path).resolve())
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ReadPool(db_path)
+        return _pools[key]
+
+@contextmanager
+def reader(db_path=DB_PATH) -> Iterator[sqlite3.Connection]:
+    """Подключение для чтения из общего пула базы (используется в with)"""
+    with get_pool(db_path).connection() as conn:
+        yield conn
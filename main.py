@@ -8,8 +8,12 @@ import argparse
 from datetime import datetime
 from pathlib import Path
 
-from parser import DividendParser
+from parser import DividendParser, refresh_indexes
+from staging import StagingStore
 import analyze_diff
+import retention
+import calendar_index
+import search
 
 def parse_arguments():
     """Парсинг аргументов командной строки"""
@@ -37,6 +41,95 @@ def parse_arguments():
         help='Максимальное количество тикеров для обработки'
     )
     
+    parser.add_argument(
+        '-r', '--max-requests', 
+        type=int,
+        default=None,
+        help='Бюджет HTTP-запросов на запуск (тикеры обходятся по убыванию приоритета)'
+    )
+    
+    parser.add_argument(
+        '-d', '--deadline', 
+        type=float,
+        default=None,
+        help='Ограничение времени обхода в секундах (тикеры обходятся по убыванию приоритета)'
+    )
+    
+    parser.add_argument(
+        '--pair', 
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=('PREV_RUN_ID', 'LAST_RUN_ID'),
+        help='Сравнить указанную пару запусков (подразумевает --analyze-only)'
+    )
+    
+    parser.add_argument(
+        '--range', 
+        type=int,
+        nargs=2,
+        default=None,
+        metavar=('FIRST_RUN_ID', 'LAST_RUN_ID'),
+        help='Сравнить все пары соседних запусков в диапазоне (подразумевает --analyze-only)'
+    )
+    
+    parser.add_argument(
+        '-w', '--workers', 
+        type=int,
+        default=None,
+        help='Число процессов для сравнения пар запусков из --range (по умолчанию - по числу ядер)'
+    )
+    
+    parser.add_argument(
+        '-o', '--online-diff', 
+        action='store_true',
+        help='Сравнивать данные с предыдущим запуском во время парсинга вместо отдельного анализа'
+    )
+    
+    parser.add_argument(
+        '-m', '--memory-staging', 
+        action='store_true',
+        help='Хранить данные запуска до публикации в основную базу в памяти вместо файла в data/staging'
+    )
+    
+    parser.add_argument(
+        '--publish-staging', 
+        type=str,
+        default=None,
+        metavar='FILE',
+        help='Опубликовать в основной базе запуск из промежуточной базы, публикация которой не удалась, и завершить работу'
+    )
+    
+    parser.add_argument(
+        '--upcoming', 
+        type=int,
+        default=None,
+        metavar='DAYS',
+        help='Показать дивидендные отсечки и выплаты на ближайшие DAYS дней и завершить работу'
+    )
+    
+    parser.add_argument(
+        '-s', '--search', 
+        type=str,
+        default=None,
+        metavar='QUERY',
+        help='Найти компании по тикеру, названию или сектору (допускаются опечатки) и завершить работу'
+    )
+    
+    parser.add_argument(
+        '--apply-retention', 
+        action='store_true',
+        help='После обработки перенести устаревшие запуски в архив и сжать базу данных'
+    )
+    
+    parser.add_argument(
+        '--restore-run', 
+        type=int,
+        default=None,
+        metavar='RUN_ID',
+        help='Восстановить запуск из архива и завершить работу'
+    )
+    
     parser.add_argument(
         '-v', '--verbose', 
         action='store_true',
@@ -56,45 +149,115 @@ def setup_environment():
     if not db_path.exists():
         print("ВНИМАНИЕ: База данных не существует и будет создана автоматически")
 
-def run_parser(max_tickers=None):
-    """Запускает парсер дивидендов"""
+def alert_important_change(record):
+    """Сообщает о важных изменениях, найденных онлайн-сравнением, не дожидаясь конца обхода"""
+    if record['entity'] == 'dividend_payments' and record['change'] in ('new', 'changed'):
+        if record['change'] == 'new':
+            amount = record['amount']
+        else:
+            amount = f"{record['amount_prev']} -> {record['amount_last']}"
+        print(f"ВНИМАНИЕ: {'новая' if record['change'] == 'new' else 'измененная'} выплата "
+              f"{record['ticker']} за {record['year']}: {amount}, отсечка {record['cutoff_date']}")
+
+def run_parser(max_tickers=None, max_requests=None, deadline=None, online_diff=False,
+               staging_in_memory=False):
+    """Запускает парсер дивидендов, возвращает признак успеха и результат онлайн-сравнения"""
     print("-" * 80)
     print(f"Запуск парсера дивидендов: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("-" * 80)
     
     try:
         # Создаем и запускаем парсер
-        parser = DividendParser(max_tickers=max_tickers)
+        parser = DividendParser(
+            max_tickers=max_tickers, max_requests=max_requests, deadline=deadline,
+            online_diff=online_diff, on_diff_change=alert_important_change if online_diff else None,
+            staging_in_memory=staging_in_memory
+        )
         parser.run()
         print("Парсер успешно завершил работу")
-        return True
+        return True, parser.diff_result
     except Exception as e:
         print(f"ОШИБКА: Парсер завершился с ошибкой: {str(e)}")
-        return False
+        return False, None
+
+def print_analysis_result(result):
+    """Выводит итог анализа расхождений"""
+    if result.get('has_differences', False):
+        print("\nОбнаружены расхождения между запусками!")
+        if 'files' in result and result['files']:
+            print("\nФайлы с отчетами:")
+            for name, file_path in result['files'].items():
+                print(f"- {name}: {file_path}")
+    else:
+        print("\nРасхождений между запусками не обнаружено или недостаточно запусков для сравнения (нужно минимум 2)")
 
-def run_analyzer():
+def run_analyzer(pair=None, run_range=None, workers=None):
     """Запускает анализ расхождений между запусками"""
     print("\n" + "-" * 80)
     print(f"Запуск анализа расхождений: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("-" * 80)
     
     try:
-        result = analyze_diff.main()
+        if run_range:
+            results = analyze_diff.analyze_range(run_range[0], run_range[1], workers=workers)
+            if not results:
+                print("\nВ диапазоне нет пар запусков для сравнения")
+            for (prev_run_id, last_run_id), result in results.items():
+                print(f"\nЗапуски {prev_run_id} и {last_run_id}:")
+                print_analysis_result(result)
+            return True
         
-        if result.get('has_differences', False):
-            print("\nОбнаружены расхождения между запусками!")
-            if 'files' in result and result['files']:
-                print("\nФайлы с отчетами:")
-                for name, file_path in result['files'].items():
-                    print(f"- {name}: {file_path}")
+        if pair:
+            result = analyze_diff.main(prev_run_id=pair[0], last_run_id=pair[1])
         else:
-            print("\nРасхождений между запусками не обнаружено или недостаточно запусков для сравнения (нужно минимум 2)")
-            
+            result = analyze_diff.main()
+        print_analysis_result(result)
         return True
     except Exception as e:
         print(f"ОШИБКА: Анализ расхождений завершился с ошибкой: {str(e)}")
         return False
 
+def run_retention():
+    """Применяет политику хранения запусков"""
+    print("\n" + "-" * 80)
+    print(f"Применение политики хранения: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("-" * 80)
+    
+    try:
+        expired = retention.apply_retention()
+        print(f"Перенесено в архив запусков: {len(expired)}")
+        return True
+    except Exception as e:
+        print(f"ОШИБКА: Применение политики хранения завершилось с ошибкой: {str(e)}")
+        return False
+
+def restore_run(run_id):
+    """Восстанавливает запуск из архива"""
+    try:
+        restored = retention.restore_run(run_id)
+        print(f"Запуск {run_id} восстановлен из архива (строк: {restored})")
+        return True
+    except Exception as e:
+        print(f"ОШИБКА: Не удалось восстановить запуск {run_id}: {str(e)}")
+        return False
+
+def publish_staging(path):
+    """Повторно публикует запуск из сохраненной промежуточной базы"""
+    try:
+        staging = StagingStore.open(path)
+        try:
+            run_id = staging.publish()
+        except Exception:
+            staging.close()
+            raise
+        staging.discard()
+        print(f"Запуск {run_id} опубликован в основной базе данных")
+        refresh_indexes(run_id)
+        return True
+    except Exception as e:
+        print(f"ОШИБКА: Не удалось опубликовать промежуточную базу {path}: {str(e)}")
+        return False
+
 def main():
     """Основная функция"""
     start_time = time.time()
@@ -109,26 +272,59 @@ def main():
     if args.verbose:
         print(f"Аргументы: {args}")
     
+    # Сравнение конкретных запусков не требует нового парсинга
+    if args.pair or args.range:
+        args.analyze_only = True
+    
     # Проверяем и настраиваем окружение
     setup_environment()
     
+    if args.restore_run is not None:
+        return 0 if restore_run(args.restore_run) else 1
+    
+    if args.publish_staging is not None:
+        return 0 if publish_staging(args.publish_staging) else 1
+    
+    if args.upcoming is not None:
+        calendar_index.print_upcoming(args.upcoming)
+        return 0
+    
+    if args.search is not None:
+        search.print_search(args.search)
+        return 0
+    
     parser_success = True
     analyzer_success = True
+    diff_result = None
     
     # Запускаем парсер, если не указан флаг analyze-only
     if not args.analyze_only:
-        parser_success = run_parser(max_tickers=args.max_tickers)
+        parser_success, diff_result = run_parser(
+            max_tickers=args.max_tickers,
+            max_requests=args.max_requests,
+            deadline=args.deadline,
+            online_diff=args.online_diff and not args.parse_only,
+            staging_in_memory=args.memory_staging
+        )
     else:
         print("Парсер пропущен (указан флаг --analyze-only)")
     
     # Запускаем анализ, если не указан флаг parse-only и парсер отработал успешно
-    if not args.parse_only and parser_success:
-        analyzer_success = run_analyzer()
+    if not args.parse_only and parser_success and diff_result is not None:
+        print("\nАнализ расхождений выполнен во время парсинга (указан флаг --online-diff)")
+        print_analysis_result(diff_result)
+    elif not args.parse_only and parser_success:
+        analyzer_success = run_analyzer(pair=args.pair, run_range=args.range, workers=args.workers)
     elif args.parse_only:
         print("\nАнализ расхождений пропущен (указан флаг --parse-only)")
     elif not parser_success:
         print("\nАнализ расхождений НЕ запущен из-за ошибки в парсере")
     
+    # Архивируем устаревшие запуски, если это запрошено
+    retention_success = True
+    if args.apply_retention:
+        retention_success = run_retention()
+    
     # Общая информация о выполнении
     elapsed_time = time.time() - start_time
     print("\n" + "=" * 80)
@@ -141,12 +337,16 @@ def main():
     else:
         status = "Успешно" if parser_success and analyzer_success else "С ошибками"
     
+    if not retention_success:
+        status = "С ошибками"
+    
     print(f"Статус выполнения: {status}")
     print("=" * 80)
     
-    return 0 if (args.parse_only and parser_success) or \
-               (args.analyze_only and analyzer_success) or \
-               (parser_success and analyzer_success) else 1
+    return 0 if retention_success and (
+               (args.parse_only and parser_success) or
+               (args.analyze_only and analyzer_success) or
+               (parser_success and analyzer_success)) else 1
 
 if __name__ == "__main__":
     sys.exit(main()) 
\ No newline at end of file
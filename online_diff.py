@@ -0,0 +1,179 @@
+from datetime import datetime
+from typing import List, Dict, Optional, Callable
+from config import DB_PATH
+from staging import StagingStore
+from analyze_diff import (
+    ensure_diff_dir_exists, PREVIOUS_SNAPSHOT_CTE, run_pair_params, make_record, format_result,
+    DiffReportWriter
+)
+import db_access
+
+class OnlineDiff:
+    """Сравнивает данные тикеров с предыдущим запуском прямо во время парсинга.
+
+    Парсер передает строки каждого тикера сразу после их записи, различия
+    дописываются в отчеты и таблицу diff_records промежуточной базы по мере
+    обхода, а удаленные компании определяются в finish(). В основную базу записи
+    переносятся только в finish(), после публикации запуска. Результат совпадает
+    с тем, что analyze_diff.main() посчитал бы после завершения запуска, поэтому
+    отдельный проход по таблицам не нужен.
+    """
+
+    def __init__(self, run_id: int, staging: StagingStore, db_path=DB_PATH,
+                 on_change: Optional[Callable[[Dict], None]] = None):
+        self.run_id = run_id
+        self.staging = staging
+        # Предыдущие данные читаются из основной базы через подключение только для чтения,
+        # а результаты до публикации запуска пишутся в diff_records промежуточной базы
+        self.reader = db_access.connect_readonly(db_path)
+        self.staging_connection = staging.engine.raw_connection()
+        self.conn = self.staging_connection.driver_connection
+        self.seen_tickers = set()
+        self.writer = None
+
+        row = self.reader.execute(
+            "SELECT MAX(id) FROM parsing_runs WHERE id < ?", (run_id,)
+        ).fetchone()
+        self.prev_run_id = row[0] if row else None
+        if self.prev_run_id is None:
+            print("Онлайн-сравнение отключено: нет предыдущего запуска")
+            return
+
+        # Последние успешные наблюдения тикеров предыдущего запуска: тикер -> (id, название, сектор)
+        query = PREVIOUS_SNAPSHOT_CTE + """
+        SELECT ticker, id, name, sector FROM prev_companies
+        """
+        self.prev_companies = {
+            ticker: (company_id, name, sector)
+            for ticker, company_id, name, sector in self.reader.execute(
+                query, run_pair_params(run_id, self.prev_run_id)
+            )
+        }
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.writer = DiffReportWriter(
+            ensure_diff_dir_exists(), run_id, self.prev_run_id, timestamp, on_change=on_change,
+            table_conn=self.conn
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.writer is not None
+
+    def _previous_rows(self, company_id: int):
+        """Загружает годовые дивиденды и выплаты компании из предыдущего наблюдения"""
+        yearly = [
+            {'year': year, 'total_amount': total_amount}
+            for year, total_amount in self.reader.execute(
+                "SELECT year, total_amount FROM yearly_dividends WHERE company_id = ? ORDER BY id",
+                (company_id,)
+            )
+        ]
+        payments = [
+            {'year': year, 'amount': amount, 'cutoff_date': cutoff_date, 'payment_date': payment_date}
+            for year, amount, cutoff_date, payment_date in self.reader.execute(
+                "SELECT year, amount, cutoff_date, payment_date FROM dividend_payments "
+                "WHERE company_id = ? ORDER BY id",
+                (company_id,)
+            )
+        ]
+        return yearly, payments
+
+    def _compare_rows(self, entity: str, ticker: str, last_rows: List[Dict], prev_rows: List[Dict],
+                      key_fields: List[str], value_field: str) -> None:
+        """Сравнивает строки одного тикера по ключу так же, как analyze_diff"""
+        def key(row):
+            return tuple(row[field] for field in key_fields)
+
+        last_by_key = {key(row): row for row in last_rows}
+        prev_by_key = {key(row): row for row in prev_rows}
+
+        for row in last_rows:
+            if key(row) not in prev_by_key:
+                self.writer.add(make_record(entity, 'new', dict(row, ticker=ticker)))
+
+        for row in prev_rows:
+            if key(row) not in last_by_key:
+                self.writer.add(make_record(entity, 'removed', dict(row, ticker=ticker)))
+
+        for row_key, last_row in last_by_key.items():
+            prev_row = prev_by_key.get(row_key)
+            if prev_row is not None and last_row[value_field] != prev_row[value_field]:
+                changed = dict(last_row, ticker=ticker)
+                changed[f'{value_field}_last'] = last_row[value_field]
+                changed[f'{value_field}_prev'] = prev_row[value_field]
+                self.writer.add(make_record(entity, 'changed', changed))
+
+    def compare_ticker(self, ticker: str, name: str, sector: str,
+                       yearly_rows: List[tuple], payment_rows: List[tuple]) -> None:
+        """Сравнивает только что записанные данные тикера с предыдущим наблюдением"""
+        if not self.enabled:
+            return
+        self.seen_tickers.add(ticker)
+
+        yearly = [{'year': year, 'total_amount': total_amount} for year, total_amount in yearly_rows]
+        payments = [
+            {'year': year, 'amount': amount, 'cutoff_date': cutoff_date, 'payment_date': payment_date}
+            for year, amount, cutoff_date, payment_date in payment_rows
+        ]
+
+        previous = self.prev_companies.get(ticker)
+        if previous is None:
+            self.writer.add(make_record('companies', 'new', {'ticker': ticker, 'name': name, 'sector': sector}))
+            prev_yearly, prev_payments = [], []
+        else:
+            company_id, prev_name, prev_sector = previous
+            if name != prev_name or sector != prev_sector:
+                self.writer.add(make_record('companies', 'changed', {
+                    'ticker': ticker,
+                    'name_prev': prev_name, 'name_last': name,
+                    'sector_prev': prev_sector, 'sector_last': sector
+                }))
+            prev_yearly, prev_payments = self._previous_rows(company_id)
+
+        self._compare_rows('yearly_dividends', ticker, yearly, prev_yearly,
+                           ['year'], 'total_amount')
+        self._compare_rows('dividend_payments', ticker, payments, prev_payments,
+                           ['year', 'cutoff_date', 'payment_date'], 'amount')
+
+    def finish(self) -> Optional[Dict]:
+        """Добавляет удаленные компании и формирует итоговые отчеты"""
+        if not self.enabled:
+            self.close()
+            return None
+
+        # Тикеры, пропущенные или не обработанные в этом запуске, удаленными не считаются
+        not_parsed = {
+            ticker for (ticker,) in self.reader.execute(
+                "SELECT ticker FROM ticker_observations WHERE parsing_run_id = ? AND status != 'parsed'",
+                (self.run_id,)
+            )
+        }
+
+        for ticker, (company_id, name, sector) in self.prev_companies.items():
+            if ticker in self.seen_tickers or ticker in not_parsed:
+                continue
+            self.writer.add(make_record('companies', 'removed', {'ticker': ticker, 'name': name, 'sector': sector}))
+            prev_yearly, prev_payments = self._previous_rows(company_id)
+            for row in prev_yearly:
+                self.writer.add(make_record('yearly_dividends', 'removed', dict(row, ticker=ticker)))
+            for row in prev_payments:
+                self.writer.add(make_record('dividend_payments', 'removed', dict(row, ticker=ticker)))
+
+        result = format_result(self.writer.close())
+        self.writer = None
+        try:
+            self.staging.publish_diffs()
+        except Exception as e:
+            # Отчеты уже готовы, записи для кэша при необходимости пересчитает analyze_diff
+            print(f"Не удалось сохранить записи о различиях в основную базу данных: {str(e)}")
+        self.close()
+        return result
+
+    def close(self) -> None:
+        """Закрывает подключения и удаляет незавершенные отчеты"""
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
+        self.reader.close()
+        self.staging_connection.close()
@@ -3,21 +3,55 @@ from bs4 import BeautifulSoup
 import pandas as pd
 from datetime import datetime
 import time
-from typing import List, Dict, Optional, Set
-from config import BASE_URL, DIVIDEND_URL, REQUEST_DELAY
-from database import Session, ParsingRun, Company, YearlyDividend, DividendPayment
+import hashlib
+from typing import List, Dict, Optional, Set, Callable
+from config import BASE_URL, DIVIDEND_URL, REQUEST_DELAY, STAGING_IN_MEMORY
+from database import ParsingRun, Company, YearlyDividend, DividendPayment, TickerObservation
+from staging import StagingStore, next_run_id
+from scheduler import CrawlScheduler, CrawlBudget
+from online_diff import OnlineDiff
+import calendar_index
+import search
+import sql_functions
 import re
 
+def refresh_indexes(run_id: int) -> None:
+    """Обновляет производные индексы данными опубликованного запуска"""
+    conn = sql_functions.connect()
+    try:
+        try:
+            events = calendar_index.refresh_calendar(conn, run_id)
+            print(f"Календарь дивидендов обновлен, добавлено событий: {events}")
+        except Exception as e:
+            print(f"Ошибка при обновлении календаря дивидендов: {str(e)}")
+        try:
+            companies = search.refresh_search(conn, run_id)
+            print(f"Поисковый индекс компаний обновлен, добавлено записей: {companies}")
+        except Exception as e:
+            print(f"Ошибка при обновлении поискового индекса: {str(e)}")
+    finally:
+        conn.close()
+
 class DividendParser:
-    def __init__(self, max_tickers: Optional[int] = None):
-        self.session = Session()
+    def __init__(self, max_tickers: Optional[int] = None, max_requests: Optional[int] = None,
+                 deadline: Optional[float] = None, online_diff: bool = False,
+                 on_diff_change: Optional[Callable[[Dict], None]] = None,
+                 staging_in_memory: bool = STAGING_IN_MEMORY):
+        # Данные запуска пишутся в промежуточную базу и попадают в основную только после успешного обхода
+        self.staging = StagingStore(next_run_id(), in_memory=staging_in_memory)
+        self.session = self.staging.Session()
         self.max_tickers = max_tickers
+        self.scheduler = CrawlScheduler()
+        self.budget = CrawlBudget(max_requests=max_requests, deadline=deadline)
         self.parsing_run = self._create_parsing_run()
         self.processed_tickers: Set[str] = set()
+        # Сравнение с предыдущим запуском по мере обхода, результат попадает в diff_result
+        self.online_diff = OnlineDiff(self.parsing_run.id, self.staging, on_change=on_diff_change) if online_diff else None
+        self.diff_result: Optional[Dict] = None
         
     def _create_parsing_run(self) -> ParsingRun:
         """Создает новую запись о запуске парсинга"""
-        run = ParsingRun()
+        run = ParsingRun(id=self.staging.run_id)
         self.session.add(run)
         self.session.commit()
         return run
@@ -25,6 +59,7 @@ class DividendParser:
     def _get_tickers_list(self) -> List[Dict[str, str]]:
         """Получает список всех тикеров с главной страницы"""
         response = requests.get(DIVIDEND_URL)
+        self.budget.spend()
         soup = BeautifulSoup(response.text, 'html.parser')
         
         # Находим таблицу с тикерами по ID
@@ -56,15 +91,46 @@ class DividendParser:
                     sector = cols[1].text.strip() if len(cols) > 1 else ""
                     tickers.append({'ticker': ticker, 'name': name, 'sector': sector})
         
+        # Сначала обходим тикеры с наибольшей ценностью повторного запроса
+        tickers = self.scheduler.prioritize(tickers)
+        
         if self.max_tickers:
-            # Если указан лимит, применяем его
+            # Если указан лимит, применяем его. Не вошедшие в лимит тикеры отмечаются
+            # как пропущенные, чтобы анализ и календарь не считали их удаленными
+            for ticker_data in tickers[self.max_tickers:]:
+                self._record_observation(ticker_data['ticker'], 'skipped', ticker_data['priority'])
             tickers = tickers[:self.max_tickers]
             
         self.parsing_run.tickers_found = len(tickers)
         self.session.commit()
         return tickers
     
-    def _parse_company_page(self, ticker: str, name: str, sector: str) -> None:
+    def _record_observation(self, ticker: str, status: str, priority: Optional[float],
+                            content_hash: Optional[str] = None) -> None:
+        """Сохраняет результат обращения к тикеру в текущем запуске"""
+        previous_hash = self.scheduler.last_hash(ticker)
+        changed = None
+        if content_hash is not None and previous_hash is not None:
+            changed = content_hash != previous_hash
+        
+        self.session.add(TickerObservation(
+            parsing_run_id=self.parsing_run.id,
+            ticker=ticker,
+            status=status,
+            # Бесконечная оценка у новых тикеров не несет информации
+            priority=priority if priority != float('inf') else None,
+            content_hash=content_hash,
+            changed=changed
+        ))
+    
+    @staticmethod
+    def _content_hash(name: str, sector: str, yearly_rows: List[tuple], payment_rows: List[tuple]) -> str:
+        """Считает хэш распарсенных данных тикера для определения изменений"""
+        content = repr((name, sector, sorted(yearly_rows), sorted(payment_rows)))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+    
+    def _parse_company_page(self, ticker: str, name: str, sector: str,
+                            priority: Optional[float] = None) -> None:
         """Парсит страницу компании"""
         # Пропускаем уже обработанные тикеры
         if ticker in self.processed_tickers:
@@ -76,6 +142,7 @@ class DividendParser:
         
         try:
             response = requests.get(url)
+            self.budget.spend()
             soup = BeautifulSoup(response.text, 'html.parser')
             
             # Создаем запись о компании
@@ -86,7 +153,12 @@ class DividendParser:
                 parsing_run_id=self.parsing_run.id  # Сохраняем ID запуска парсера
             )
             self.session.add(company)
-            self.session.commit()
+            # Фиксируем компанию только вместе с ее дивидендами, чтобы при ошибке
+            # в базе не оставалось частично обработанных тикеров
+            self.session.flush()
+            
+            yearly_rows = []
+            payment_rows = []
             
             # Находим все таблицы на странице
             tables = soup.find_all('table', {'class': 'content-table'})
@@ -94,12 +166,16 @@ class DividendParser:
             
             if len(tables) >= 1:
                 print("Парсинг годовых дивидендов")
-                self._parse_yearly_dividends(company, tables[0])
+                yearly_rows = self._parse_yearly_dividends(company, tables[0])
                 
             if len(tables) >= 2:
                 print("Парсинг всех выплат")
-                self._parse_all_dividends(company, tables[1])
+                payment_rows = self._parse_all_dividends(company, tables[1])
                 
+            self._record_observation(
+                ticker, 'parsed', priority,
+                content_hash=self._content_hash(name, sector, yearly_rows, payment_rows)
+            )
             self.parsing_run.tickers_processed += 1
             self.processed_tickers.add(ticker)  # Добавляем тикер в множество обработанных
             self.session.commit()
@@ -107,10 +183,24 @@ class DividendParser:
         except Exception as e:
             print(f"Ошибка при парсинге компании {ticker}: {str(e)}")
             self.session.rollback()
+            self._record_observation(ticker, 'failed', priority)
+            self.session.commit()
+            return
         
-    def _parse_yearly_dividends(self, company: Company, table: BeautifulSoup) -> None:
-        """Парсит таблицу с годовыми дивидендами"""
+        if self.online_diff:
+            try:
+                self.online_diff.compare_ticker(ticker, name, sector, yearly_rows, payment_rows)
+            except Exception as e:
+                # Сравнение без этого тикера было бы неполным: отчеты и записи о различиях
+                # отбрасываются, а пару запусков после обхода сравнит analyze_diff
+                print(f"Ошибка онлайн-сравнения тикера {ticker}: {str(e)}, онлайн-сравнение отменено")
+                self.online_diff.close()
+                self.online_diff = None
+        
+    def _parse_yearly_dividends(self, company: Company, table: BeautifulSoup) -> List[tuple]:
+        """Парсит таблицу с годовыми дивидендами, возвращает добавленные строки"""
         rows = table.find_all('tr')[1:]  # Пропускаем заголовок
+        parsed_rows = []
         print(f"Найдено строк в таблице годовых дивидендов: {len(rows)}")
         
         for i, row in enumerate(rows):
@@ -136,17 +226,20 @@ class DividendParser:
                         total_amount=amount_text
                     )
                     self.session.add(dividend)
+                    parsed_rows.append((year_text, amount_text))
                     print("Запись добавлена в базу данных")
                     
                 except Exception as e:
                     print(f"Ошибка при парсинге годовых дивидендов: {e}")
                     print(f"Данные строки: {[col.text.strip() for col in cols]}")
             
-        self.session.commit()
+        self.session.flush()
+        return parsed_rows
                 
-    def _parse_all_dividends(self, company: Company, table: BeautifulSoup) -> None:
-        """Парсит таблицу со всеми выплатами"""
+    def _parse_all_dividends(self, company: Company, table: BeautifulSoup) -> List[tuple]:
+        """Парсит таблицу со всеми выплатами, возвращает добавленные строки"""
         rows = table.find_all('tr')[1:]  # Пропускаем заголовок
+        parsed_rows = []
         print(f"Найдено строк в таблице всех выплат: {len(rows)}")
         
         for i, row in enumerate(rows, 1):
@@ -176,6 +269,7 @@ class DividendParser:
                     payment_date=payment_date
                 )
                 self.session.add(payment)
+                parsed_rows.append((year, amount, cutoff_date, payment_date))
                 print("Запись добавлена в базу данных")
                 
             except Exception as e:
@@ -183,30 +277,79 @@ class DividendParser:
                 print(f"Данные строки: {data if 'data' in locals() else 'нет данных'}")
                 continue
         
-        self.session.commit()
+        self.session.flush()
+        return parsed_rows
+    
+    def _publish(self) -> int:
+        """Переносит завершенный запуск в основную базу, возвращает его ID"""
+        run_id = self.staging.publish()
+        print(f"Запуск {run_id} опубликован в основной базе данных")
+        if run_id != self.staging.run_id and self.online_diff:
+            # Отчеты онлайн-сравнения привязаны к исходному ID, различия посчитает analyze_diff
+            print(f"ID запуска {self.staging.run_id} занят другим запуском, онлайн-сравнение отменено")
+            self.online_diff.close()
+            self.online_diff = None
+        return run_id
     
     def run(self) -> None:
-        """Запускает процесс парсинга"""
+        """Запускает процесс парсинга, при ошибке обхода или публикации выбрасывает исключение"""
+        keep_staging = False
         try:
             tickers = self._get_tickers_list()
             print(f"Найдено тикеров: {len(tickers)}")
             
+            skipped = 0
             for ticker_data in tickers:
+                if self.budget.exhausted():
+                    # Бюджет исчерпан: отмечаем тикер как пропущенный, чтобы анализ
+                    # сравнивал его с последним успешным наблюдением
+                    self._record_observation(ticker_data['ticker'], 'skipped', ticker_data['priority'])
+                    skipped += 1
+                    continue
+                    
                 print(f"\nПарсинг {ticker_data['ticker']} - {ticker_data['name']} - Сектор: {ticker_data['sector']}")
-                self._parse_company_page(ticker_data['ticker'], ticker_data['name'], ticker_data['sector'])
+                self._parse_company_page(
+                    ticker_data['ticker'], ticker_data['name'], ticker_data['sector'],
+                    priority=ticker_data['priority']
+                )
                 time.sleep(REQUEST_DELAY)
                 
+            if skipped:
+                print(f"Бюджет обхода исчерпан, пропущено тикеров: {skipped}")
+                
             self.parsing_run.status = 'completed'
             self.parsing_run.end_time = datetime.now()
             self.session.commit()
             
+            try:
+                run_id = self._publish()
+            except Exception:
+                # Обход завершен, поэтому данные запуска сохраняются для повторной публикации
+                keep_staging = self.staging.path is not None
+                raise
+            refresh_indexes(run_id)
+            
+            if self.online_diff:
+                try:
+                    self.diff_result = self.online_diff.finish()
+                except Exception as e:
+                    # Запуск уже опубликован, различия посчитает analyze_diff
+                    print(f"Ошибка онлайн-сравнения: {str(e)}")
+            
         except Exception as e:
+            # Незавершенный запуск в основную базу не попадает
             print(f"Критическая ошибка: {str(e)}")
-            self.parsing_run.status = 'failed'
-            self.parsing_run.end_time = datetime.now()
-            self.session.commit()
+            raise
         finally:
+            if self.online_diff:
+                self.online_diff.close()
             self.session.close()
+            if keep_staging:
+                self.staging.close()
+                print(f"Данные запуска сохранены в {self.staging.path}, "
+                      f"повторить публикацию: python main.py --publish-staging {self.staging.path}")
+            else:
+                self.staging.discard()
 
 if __name__ == "__main__":
     # Запускаем парсер без ограничений на количество тикеров
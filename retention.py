@@ -0,0 +1,237 @@
+import os
+import gzip
+import json
+from datetime import datetime
+from typing import List, Dict, Set, Optional
+from config import (
+    DB_PATH, ARCHIVE_DIR, RETENTION_KEEP_LAST, RETENTION_KEEP_WEEKLY,
+    RETENTION_KEEP_MONTHLY, RETENTION_BATCH_SIZE
+)
+import sql_functions
+import database  # Создает недостающие таблицы и индексы, по которым идет пакетное удаление
+
+# Таблицы с данными запуска в порядке от родительских к дочерним.
+# Условие отбирает строки одного запуска по параметру :run_id
+RUN_TABLES = [
+    ('parsing_runs', 'id = :run_id'),
+    ('companies', 'parsing_run_id = :run_id'),
+    ('yearly_dividends', 'company_id IN (SELECT id FROM companies WHERE parsing_run_id = :run_id)'),
+    ('dividend_payments', 'company_id IN (SELECT id FROM companies WHERE parsing_run_id = :run_id)'),
+    ('ticker_observations', 'parsing_run_id = :run_id'),
+]
+
+# Производные данные запуска: не архивируются, а удаляются и при необходимости вычисляются заново
+DERIVED_TABLES = [
+    ('diff_records', 'diff_pair_id IN (SELECT id FROM diff_pairs '
+                     'WHERE prev_run_id = :run_id OR last_run_id = :run_id)'),
+    ('diff_pairs', 'prev_run_id = :run_id OR last_run_id = :run_id'),
+]
+
+def _parse_start_time(value: Optional[str]) -> Optional[datetime]:
+    """Разбирает время начала запуска в формате SQLite"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def select_expired_runs(runs: List[Dict], keep_last: int = RETENTION_KEEP_LAST,
+                        keep_weekly: int = RETENTION_KEEP_WEEKLY,
+                        keep_monthly: int = RETENTION_KEEP_MONTHLY,
+                        protected: Optional[Set[int]] = None) -> List[int]:
+    """Определяет запуски, которые не подпадают под политику хранения.
+
+    Хранятся последние keep_last запусков, а также самый свежий завершенный запуск
+    в каждой из последних keep_weekly недель и keep_monthly месяцев. Незавершенные
+    запуски и запуски из protected не удаляются никогда.
+    """
+    runs = sorted(runs, key=lambda run: (run['start_time'] or '', run['id']), reverse=True)
+    keep = set(protected or ())
+    keep.update(run['id'] for run in runs[:keep_last])
+
+    weeks_seen = []
+    months_seen = []
+    for run in runs:
+        if run['status'] == 'running':
+            keep.add(run['id'])
+            continue
+        if run['status'] != 'completed':
+            continue
+        start_time = _parse_start_time(run['start_time'])
+        if start_time is None:
+            continue
+
+        week = tuple(start_time.isocalendar())[:2]
+        if week not in weeks_seen and len(weeks_seen) < keep_weekly:
+            weeks_seen.append(week)
+            keep.add(run['id'])
+
+        month = (start_time.year, start_time.month)
+        if month not in months_seen and len(months_seen) < keep_monthly:
+            months_seen.append(month)
+            keep.add(run['id'])
+
+    return sorted(run['id'] for run in runs if run['id'] not in keep)
+
+def _protected_runs(conn) -> Set[int]:
+    """Запуски с последним успешным наблюдением тикеров, актуальных в последнем запуске.
+
+    Анализ различий и планировщик обхода опираются на эти наблюдения, поэтому
+    запуски, в которых пропущенный тикер был обработан последний раз, не удаляются.
+    """
+    query = """
+    SELECT DISTINCT latest.run_id
+    FROM (
+        SELECT c.ticker, MAX(c.parsing_run_id) AS run_id
+        FROM companies c
+        WHERE c.ticker IN (
+            SELECT ticker FROM ticker_observations
+            WHERE parsing_run_id = (SELECT MAX(id) FROM parsing_runs)
+        )
+        GROUP BY c.ticker
+    ) latest
+    """
+    return {row[0] for row in conn.execute(query)}
+
+def archive_path(run_id: int) -> str:
+    """Путь к архиву запуска"""
+    return os.path.join(ARCHIVE_DIR, f"run_{run_id}.json.gz")
+
+def archive_run(conn, run_id: int) -> str:
+    """Выгружает все строки запуска в сжатый архив и возвращает путь к нему.
+
+    Существующий архив не перезаписывается: он остается от прерванного удаления,
+    после которого в базе уже нет части строк запуска, и тогда удаление лишь продолжается.
+    """
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    path = archive_path(run_id)
+    if os.path.exists(path):
+        return path
+    tmp_path = path + '.tmp'
+
+    tables = {}
+    for table, condition in RUN_TABLES:
+        cursor = conn.execute(f"SELECT * FROM {table} WHERE {condition}", {'run_id': run_id})
+        tables[table] = {
+            'columns': [column[0] for column in cursor.description],
+            'rows': cursor.fetchall()
+        }
+
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump({
+            'run_id': run_id,
+            'archived_at': datetime.now().isoformat(),
+            'tables': tables
+        }, f, ensure_ascii=False)
+    # Архив появляется под итоговым именем только целиком записанным
+    os.replace(tmp_path, path)
+    return path
+
+def _delete_in_batches(conn, table: str, condition: str, run_id: int, batch_size: int) -> int:
+    """Удаляет строки запуска из таблицы пакетами, фиксируя каждый пакет отдельно"""
+    deleted = 0
+    while True:
+        cursor = conn.execute(
+            f"DELETE FROM {table} WHERE rowid IN "
+            f"(SELECT rowid FROM {table} WHERE {condition} LIMIT :limit)",
+            {'run_id': run_id, 'limit': batch_size}
+        )
+        conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
+
+def delete_run(conn, run_id: int, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Удаляет запуск из рабочих таблиц, начиная с дочерних"""
+    deleted = 0
+    for table, condition in DERIVED_TABLES + list(reversed(RUN_TABLES)):
+        deleted += _delete_in_batches(conn, table, condition, run_id, batch_size)
+    return deleted
+
+def restore_run(run_id: int, db_path=DB_PATH) -> int:
+    """Возвращает запуск из архива в рабочие таблицы, возвращает число строк"""
+    path = archive_path(run_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Архив запуска {run_id} не найден: {path}")
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        archive = json.load(f)
+
+    conn = sql_functions.connect(db_path)
+    try:
+        if conn.execute("SELECT 1 FROM parsing_runs WHERE id = ?", (run_id,)).fetchone():
+            raise ValueError(f"Запуск {run_id} уже есть в базе данных")
+
+        restored = 0
+        with conn:
+            for table, _ in RUN_TABLES:
+                data = archive['tables'].get(table)
+                if not data or not data['rows']:
+                    continue
+                # Восстанавливаем только колонки, которые есть в текущей схеме
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                indexes = [i for i, column in enumerate(data['columns']) if column in existing]
+                columns = ', '.join(data['columns'][i] for i in indexes)
+                placeholders = ', '.join('?' for _ in indexes)
+                conn.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+                    ([row[i] for i in indexes] for row in data['rows'])
+                )
+                restored += len(data['rows'])
+    finally:
+        conn.close()
+
+    os.remove(path)
+    return restored
+
+def compact_database(conn) -> None:
+    """Возвращает освободившиеся страницы файлу и обновляет статистику планировщика запросов"""
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if auto_vacuum != 2:
+        # Режим INCREMENTAL включается только полной перестройкой файла, это делается один раз
+        print("Перевод базы данных в режим incremental auto_vacuum (однократный VACUUM)...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        # execute() выполняет только первый шаг прагмы (одна страница),
+        # executescript() - до конца, возвращая файлу все свободные страницы
+        conn.executescript("PRAGMA incremental_vacuum;")
+    # После удаления большого числа строк статистика устаревает целиком: PRAGMA optimize
+    # на новом подключении может ее не обновить. Ограничение выборки ускоряет ANALYZE
+    conn.execute("PRAGMA analysis_limit = 1000")
+    conn.execute("ANALYZE")
+    conn.commit()
+
+def apply_retention(db_path=DB_PATH, keep_last: int = RETENTION_KEEP_LAST,
+                    keep_weekly: int = RETENTION_KEEP_WEEKLY,
+                    keep_monthly: int = RETENTION_KEEP_MONTHLY,
+                    batch_size: int = RETENTION_BATCH_SIZE) -> List[int]:
+    """Архивирует и удаляет запуски вне политики хранения, затем сжимает базу"""
+    conn = sql_functions.connect(db_path)
+    try:
+        runs = [
+            {'id': run_id, 'start_time': start_time, 'status': status}
+            for run_id, start_time, status in conn.execute(
+                "SELECT id, start_time, status FROM parsing_runs"
+            )
+        ]
+        expired = select_expired_runs(
+            runs, keep_last, keep_weekly, keep_monthly, protected=_protected_runs(conn)
+        )
+
+        for run_id in expired:
+            path = archive_run(conn, run_id)
+            deleted = delete_run(conn, run_id, batch_size)
+            print(f"Запуск {run_id} перенесен в архив {path} (удалено строк: {deleted})")
+
+        if expired:
+            compact_database(conn)
+    finally:
+        conn.close()
+
+    return expired
+
+if __name__ == "__main__":
+    expired = apply_retention()
+    print(f"Перенесено в архив запусков: {len(expired)}")
@@ -0,0 +1,138 @@
+import time
+from datetime import date
+from typing import List, Dict, Optional
+from config import (
+    DB_PATH, SCHEDULER_HISTORY_RUNS, SCHEDULER_CALENDAR_HORIZON_DAYS,
+    SCHEDULER_DEFAULT_CHANGE_RATE, SCHEDULER_CHANGE_WEIGHT,
+    SCHEDULER_CALENDAR_WEIGHT, SCHEDULER_STALENESS_WEIGHT
+)
+import db_access
+
+class CrawlBudget:
+    """Ограничение обхода по количеству запросов и/или по времени"""
+
+    def __init__(self, max_requests: Optional[int] = None, deadline: Optional[float] = None):
+        self.max_requests = max_requests
+        self.deadline = deadline  # Секунды от начала обхода
+        self.requests_made = 0
+        self.started_at = time.monotonic()
+
+    def spend(self, requests_count: int = 1) -> None:
+        """Учитывает выполненные запросы"""
+        self.requests_made += requests_count
+
+    def exhausted(self) -> bool:
+        """Проверяет, исчерпан ли бюджет"""
+        if self.max_requests is not None and self.requests_made >= self.max_requests:
+            return True
+        if self.deadline is not None and time.monotonic() - self.started_at >= self.deadline:
+            return True
+        return False
+
+class CrawlScheduler:
+    """Определяет порядок обхода тикеров по ценности их повторного запроса.
+
+    Оценка тикера складывается из частоты изменений его страницы в прошлых
+    наблюдениях, близости ближайшей даты отсечки/выплаты и давности последнего
+    успешного наблюдения. Тикеры, которые еще ни разу не обрабатывались,
+    всегда идут первыми.
+    """
+
+    def __init__(self, db_path=DB_PATH, today: Optional[date] = None):
+        self.db_path = db_path
+        self.today = today or date.today()
+        self.change_rates: Dict[str, float] = {}
+        self.last_hashes: Dict[str, str] = {}
+        self.runs_since_seen: Dict[str, int] = {}
+        self.calendar_distance: Dict[str, int] = {}
+        self._load_history()
+
+    def _load_history(self) -> None:
+        """Загружает историю наблюдений тикеров из базы данных"""
+        with db_access.reader(self.db_path) as conn:
+            self._load_observations(conn)
+            self._load_staleness(conn)
+            self._load_calendar(conn)
+
+    def _load_observations(self, conn) -> None:
+        """Считает частоту изменений по последним наблюдениям каждого тикера"""
+        query = """
+        SELECT ticker, content_hash, changed
+        FROM (
+            SELECT ticker, content_hash, changed,
+                   ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY parsing_run_id DESC) AS row_num
+            FROM ticker_observations
+            WHERE status = 'parsed'
+        )
+        WHERE row_num <= ?
+        ORDER BY ticker, row_num
+        """
+        changes: Dict[str, List[int]] = {}
+        for ticker, content_hash, changed in conn.execute(query, (SCHEDULER_HISTORY_RUNS,)):
+            # Первая строка по тикеру - самое свежее наблюдение
+            self.last_hashes.setdefault(ticker, content_hash)
+            if changed is not None:
+                changes.setdefault(ticker, []).append(changed)
+
+        self.change_rates = {
+            ticker: sum(values) / len(values) for ticker, values in changes.items()
+        }
+
+    def _load_staleness(self, conn) -> None:
+        """Считает, сколько запусков назад тикер был успешно обработан"""
+        query = """
+        SELECT c.ticker, (SELECT MAX(id) FROM parsing_runs) - MAX(c.parsing_run_id)
+        FROM companies c
+        GROUP BY c.ticker
+        """
+        self.runs_since_seen = {ticker: runs for ticker, runs in conn.execute(query)}
+
+    def _load_calendar(self, conn) -> None:
+        """Находит ближайшую к сегодняшнему дню дату отсечки или выплаты каждого тикера"""
+        query = """
+        SELECT c.ticker, ru_date(dp.cutoff_date), ru_date(dp.payment_date)
+        FROM dividend_payments dp
+        JOIN companies c ON dp.company_id = c.id
+        JOIN (
+            SELECT ticker, MAX(parsing_run_id) AS run_id
+            FROM companies
+            GROUP BY ticker
+        ) latest ON latest.ticker = c.ticker AND latest.run_id = c.parsing_run_id
+        """
+        for ticker, cutoff_date, payment_date in conn.execute(query):
+            for event_date in (cutoff_date, payment_date):
+                if event_date is None:
+                    continue
+                distance = abs((date.fromisoformat(event_date) - self.today).days)
+                if distance < self.calendar_distance.get(ticker, distance + 1):
+                    self.calendar_distance[ticker] = distance
+
+    def last_hash(self, ticker: str) -> Optional[str]:
+        """Возвращает хэш данных тикера из последнего успешного наблюдения"""
+        return self.last_hashes.get(ticker)
+
+    def score(self, ticker: str) -> float:
+        """Оценивает ценность повторного запроса страницы тикера"""
+        if ticker not in self.runs_since_seen:
+            return float('inf')
+
+        change_rate = self.change_rates.get(ticker, SCHEDULER_DEFAULT_CHANGE_RATE)
+
+        distance = self.calendar_distance.get(ticker)
+        if distance is None or distance > SCHEDULER_CALENDAR_HORIZON_DAYS:
+            calendar = 0.0
+        else:
+            calendar = 1 - distance / SCHEDULER_CALENDAR_HORIZON_DAYS
+
+        staleness = min(self.runs_since_seen[ticker] / SCHEDULER_HISTORY_RUNS, 1.0)
+
+        return (SCHEDULER_CHANGE_WEIGHT * change_rate +
+                SCHEDULER_CALENDAR_WEIGHT * calendar +
+                SCHEDULER_STALENESS_WEIGHT * staleness)
+
+    def prioritize(self, tickers: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """Сортирует тикеры по убыванию оценки и добавляет ее в поле priority"""
+        for ticker_data in tickers:
+            ticker_data['priority'] = self.score(ticker_data['ticker'])
+        # sorted стабилен, поэтому при равных оценках сохраняется порядок с сайта
+        return sorted(tickers, key=lambda ticker_data: ticker_data['priority'], reverse=True)
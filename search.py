@@ -0,0 +1,173 @@
+import sys
+import sqlite3
+from typing import List, Dict
+from config import DB_PATH, SEARCH_RESULTS_LIMIT
+import db_access
+from db_access import SNAPSHOT_CTE, LISTED_TICKERS
+
+SEARCH_COLUMNS = ['ticker', 'name', 'sector']
+
+# Веса столбцов в bm25: совпадение в тикере важнее совпадения в названии и секторе
+RANK_EXPRESSION = "bm25(company_search, 10.0, 5.0, 1.0)"
+
+# Строки компаний, отобранные CTE selected
+SEARCH_SELECT = """
+SELECT ticker, name, sector, parsing_run_id FROM selected
+"""
+
+INSERT_ROWS = """
+INSERT INTO company_search (ticker, name, sector, parsing_run_id)
+"""
+
+def _create_table(conn, tokenizer: str) -> None:
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS company_search "
+        f"USING fts5(ticker, name, sector, parsing_run_id UNINDEXED, tokenize='{tokenizer}')"
+    )
+
+def ensure_search_table(conn) -> None:
+    """Создает полнотекстовый индекс company_search, если его еще нет.
+
+    Используется токенизатор trigram (поиск по любой подстроке от 3 символов),
+    в SQLite старше 3.34 - unicode61 с поиском по префиксам слов.
+    """
+    try:
+        _create_table(conn, 'trigram')
+    except sqlite3.OperationalError:
+        _create_table(conn, 'unicode61 remove_diacritics 2')
+
+def _search_table_sql(conn):
+    """Определение таблицы company_search или None, если индекс еще не создан"""
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'company_search'"
+    ).fetchone()
+    return row[0] if row else None
+
+def rebuild_search(conn) -> int:
+    """Полностью перестраивает поисковый индекс по снимку последнего запуска.
+
+    В индекс попадают только тикеры из списка на сайте в этом запуске
+    (для каждого - последнее успешное наблюдение, см. db_access.SNAPSHOT_CTE).
+    """
+    ensure_search_table(conn)
+    row = conn.execute("SELECT MAX(id) FROM parsing_runs").fetchone()
+    with conn:
+        conn.execute("DELETE FROM company_search")
+        if row[0] is None:
+            return 0
+        cursor = conn.execute(INSERT_ROWS + SNAPSHOT_CTE + """
+        , selected AS (
+            SELECT * FROM snapshot
+        )
+        """ + SEARCH_SELECT, {'run_id': row[0]})
+    return cursor.rowcount
+
+def refresh_search(conn, run_id: int) -> int:
+    """Обновляет поисковый индекс после запуска.
+
+    Заменяет строки обработанных в запуске тикеров и удаляет тикеры, которых
+    больше нет в списке на сайте. Строки пропущенных тикеров остаются.
+    """
+    ensure_search_table(conn)
+    if conn.execute("SELECT 1 FROM company_search LIMIT 1").fetchone() is None:
+        return rebuild_search(conn)
+
+    with conn:
+        conn.execute(
+            """
+            DELETE FROM company_search
+            WHERE ticker IN (SELECT ticker FROM companies WHERE parsing_run_id = :run_id)
+               OR ticker NOT IN (""" + LISTED_TICKERS + """)
+            """,
+            {'run_id': run_id}
+        )
+        cursor = conn.execute(INSERT_ROWS + """
+        WITH selected AS (
+            SELECT * FROM companies WHERE parsing_run_id = :run_id
+        )
+        """ + SEARCH_SELECT, {'run_id': run_id})
+    return cursor.rowcount
+
+def _quote(term: str) -> str:
+    """Экранирует строку для использования в выражении MATCH"""
+    return '"' + term.replace('"', '""') + '"'
+
+def _match_expressions(query: str, trigram: bool) -> List[str]:
+    """Выражения MATCH по убыванию строгости: точная подстрока, затем поиск с опечатками"""
+    words = query.split()
+    if trigram:
+        exact = ' AND '.join(_quote(word) for word in words if len(word) >= 3)
+        # При опечатке совпадает часть триграмм, bm25 ставит выше строки с большим числом совпадений
+        trigrams = {word[i:i + 3] for word in words for i in range(len(word) - 2)}
+        fuzzy = ' OR '.join(_quote(trigram) for trigram in sorted(trigrams))
+    else:
+        exact = ' AND '.join(_quote(word) + '*' for word in words)
+        fuzzy = ' OR '.join(_quote(word[:3]) + '*' for word in words)
+    # Опечатки ищутся только в тикере и названии, иначе любое слово сектора дает совпадение
+    return [exact, '{ticker name} : (' + fuzzy + ')' if fuzzy else '']
+
+def _search_short(conn, query: str, limit: int) -> List[Dict]:
+    """Поиск по строке короче триграммы: таблица содержит по одной строке на тикер,
+    поэтому ее перебор занимает доли миллисекунды"""
+    needle = query.casefold()
+    matches = []
+    for ticker, name, sector in conn.execute("SELECT ticker, name, sector FROM company_search"):
+        ticker_text, name_text = (ticker or '').casefold(), (name or '').casefold()
+        if ticker_text.startswith(needle):
+            rank = 0
+        elif name_text.startswith(needle):
+            rank = 1
+        elif needle in ticker_text or needle in name_text:
+            rank = 2
+        else:
+            continue
+        matches.append((rank, ticker, {'ticker': ticker, 'name': name, 'sector': sector, 'rank': float(rank)}))
+    matches.sort(key=lambda match: match[:2])
+    return [match[2] for match in matches[:limit]]
+
+def search_companies(query: str, limit: int = SEARCH_RESULTS_LIMIT, db_path=DB_PATH) -> List[Dict]:
+    """Ищет компании по тикеру, названию или сектору.
+
+    Сначала возвращаются строки, содержащие все слова запроса, затем - похожие
+    на запрос (с опечатками). Внутри каждой группы порядок задает bm25.
+    """
+    query = query.strip()
+    if not query:
+        return []
+
+    with db_access.reader(db_path) as conn:
+        table_sql = _search_table_sql(conn)
+        if table_sql is None:
+            # Индекс создается после первого завершенного запуска
+            return []
+        trigram = 'trigram' in table_sql
+        if trigram and max(len(word) for word in query.split()) < 3:
+            return _search_short(conn, query, limit)
+
+        results = []
+        found = set()
+        for expression in _match_expressions(query, trigram):
+            if not expression or len(results) >= limit:
+                continue
+            rows = conn.execute(
+                f"SELECT ticker, name, sector, {RANK_EXPRESSION} AS rank "
+                "FROM company_search WHERE company_search MATCH ? ORDER BY rank LIMIT ?",
+                (expression, limit)
+            )
+            for row in rows:
+                if row[0] not in found and len(results) < limit:
+                    found.add(row[0])
+                    results.append(dict(zip(SEARCH_COLUMNS + ['rank'], row)))
+        return results
+
+def print_search(query: str) -> None:
+    """Выводит результаты поиска компаний"""
+    results = search_companies(query)
+    if not results:
+        print(f"По запросу '{query}' ничего не найдено")
+        return
+    for result in results:
+        print(f"{result['ticker']}: {result['name']}, Сектор: {result['sector']}")
+
+if __name__ == "__main__":
+    print_search(' '.join(sys.argv[1:]))
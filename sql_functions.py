@@ -0,0 +1,60 @@
+import re
+import sqlite3
+from datetime import date
+from typing import Optional
+from config import DB_PATH
+
+# Суммы хранятся как на сайте: "1 250,5", "33,3 ₽" и т.п.
+AMOUNT_PATTERN = re.compile(r'-?\d+(?:[.,]\d+)?')
+AMOUNT_SPACES = re.compile(r'\s')  # В том числе неразрывные пробелы
+DATE_PATTERN = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})')
+
+# Индексы по выражениям над текстовыми колонками: запросы с тем же выражением
+# в WHERE / ORDER BY используют индекс вместо полного перебора таблицы
+EXPRESSION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_yearly_dividends_ru_amount "
+    "ON yearly_dividends (ru_amount(total_amount))",
+    "CREATE INDEX IF NOT EXISTS idx_dividend_payments_ru_amount "
+    "ON dividend_payments (ru_amount(amount))",
+    "CREATE INDEX IF NOT EXISTS idx_dividend_payments_ru_cutoff_date "
+    "ON dividend_payments (ru_date(cutoff_date))",
+    "CREATE INDEX IF NOT EXISTS idx_dividend_payments_ru_payment_date "
+    "ON dividend_payments (ru_date(payment_date))",
+]
+
+def ru_amount(text: Optional[str]) -> Optional[float]:
+    """Преобразует сумму в русском формате ("1 250,5") в число"""
+    if text is None:
+        return None
+    match = AMOUNT_PATTERN.search(AMOUNT_SPACES.sub('', str(text)))
+    if not match:
+        return None
+    return float(match.group().replace(',', '.'))
+
+def ru_date(text: Optional[str]) -> Optional[str]:
+    """Преобразует дату ДД.ММ.ГГГГ в ISO-строку ГГГГ-ММ-ДД, которая сортируется как дата"""
+    if not text:
+        return None
+    match = DATE_PATTERN.search(str(text))
+    if not match:
+        return None
+    day, month, year = (int(part) for part in match.groups())
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+def register_functions(conn) -> None:
+    """Регистрирует функции разбора сумм и дат в подключении sqlite3.
+
+    Функции детерминированы, поэтому их можно использовать в индексах. Любое
+    подключение, которое изменяет таблицы с такими индексами, должно их регистрировать.
+    """
+    conn.create_function('ru_amount', 1, ru_amount, deterministic=True)
+    conn.create_function('ru_date', 1, ru_date, deterministic=True)
+
+def connect(db_path=DB_PATH) -> sqlite3.Connection:
+    """Открывает подключение sqlite3 с зарегистрированными функциями"""
+    conn = sqlite3.connect(db_path)
+    register_functions(conn)
+    return conn
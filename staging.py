@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from config import (
+    DB_PATH, STAGING_DIR, STAGING_IN_MEMORY, STAGING_BUSY_TIMEOUT, STAGING_PUBLISH_RETRIES
+)
+from database import Base
+import sql_functions
+import db_access
+
+# Таблицы запуска в порядке от родительских к дочерним и выражения для столбцов,
+# которые меняются при переносе в основную базу (None - значение назначает основная база)
+PUBLISH_TABLES = [
+    ('parsing_runs', {'id': ':run_id'}),
+    ('companies', {'id': 'id + :company_offset', 'parsing_run_id': ':run_id'}),
+    ('yearly_dividends', {'id': None, 'company_id': 'company_id + :company_offset'}),
+    ('dividend_payments', {'id': None, 'company_id': 'company_id + :company_offset'}),
+    ('ticker_observations', {'id': None, 'parsing_run_id': ':run_id'}),
+]
+
+def next_run_id(db_path=DB_PATH) -> int:
+    """ID, который получит следующий запуск в основной базе"""
+    with db_access.reader(db_path) as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM parsing_runs").fetchone()[0]
+
+def _publish_statement(table: str, overrides: dict) -> str:
+    """INSERT ... SELECT переноса строк таблицы из промежуточной базы в основную (store)"""
+    targets, values = [], []
+    for column in Base.metadata.tables[table].columns:
+        expression = overrides.get(column.name, column.name)
+        if expression is None:
+            continue
+        targets.append(column.name)
+        values.append(expression)
+    return (f"INSERT INTO store.{table} ({', '.join(targets)}) "
+            f"SELECT {', '.join(values)} FROM main.{table} ORDER BY id")
+
+class StagingStore:
+    """Промежуточная база данных одного запуска парсера.
+
+    Парсер пишет в отдельный файл (или в память) с ослабленными гарантиями
+    сохранности, поэтому основная база не блокируется во время обхода и не видит
+    незавершенный запуск. После успешного обхода данные переносятся в основную
+    базу одной транзакцией в publish(), при ошибке обхода промежуточная база
+    удаляется. Если не удалась сама публикация, файл сохраняется, и запуск можно
+    опубликовать позже через StagingStore.open(). Записи онлайн-сравнения тоже
+    копятся здесь и переносятся в основную базу после публикации запуска.
+    """
+
+    def __init__(self, run_id: int, in_memory: bool = STAGING_IN_MEMORY, db_path=DB_PATH,
+                 path: Optional[Path] = None):
+        self.run_id = run_id
+        self.db_path = db_path
+        if path is not None:
+            # Сохраненная промежуточная база, публикация которой не удалась
+            self.path = Path(path)
+            self.engine = create_engine(f'sqlite:///{self.path}')
+        elif in_memory:
+            self.path = None
+            # Все сессии должны работать с одним подключением, иначе каждое получит свою пустую базу
+            self.engine = create_engine(
+                'sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False}
+            )
+        else:
+            STAGING_DIR.mkdir(parents=True, exist_ok=True)
+            # Уникальное имя: одновременные запуски могут зарезервировать один и тот же ID
+            fd, path = tempfile.mkstemp(dir=STAGING_DIR, prefix=f"run_{run_id}_", suffix='.db')
+            os.close(fd)
+            self.path = Path(path)
+            self.engine = create_engine(f'sqlite:///{self.path}')
+        event.listen(self.engine, 'connect', self._set_sqlite_pragmas)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    @classmethod
+    def open(cls, path, db_path=DB_PATH) -> 'StagingStore':
+        """Открывает сохраненную промежуточную базу для повторной публикации"""
+        path = Path(path)
+        if not path.exists():
+            raise FileNotFoundError(f"Промежуточная база не найдена: {path}")
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT id, status FROM parsing_runs").fetchone()
+        finally:
+            conn.close()
+        if row is None or row[1] != 'completed':
+            raise ValueError(f"В промежуточной базе {path} нет завершенного запуска")
+        return cls(row[0], db_path=db_path, path=path)
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Ослабляет гарантии сохранности: при сбое запуск все равно не публикуется"""
+        dbapi_connection.execute('PRAGMA journal_mode = MEMORY')
+        dbapi_connection.execute('PRAGMA synchronous = OFF')
+        dbapi_connection.execute('PRAGMA temp_store = MEMORY')
+        # Нужны для записи в таблицы основной базы с индексами по выражениям
+        sql_functions.register_functions(dbapi_connection)
+
+    def publish(self, retries: int = STAGING_PUBLISH_RETRIES) -> int:
+        """Переносит данные запуска в основную базу одной транзакцией, возвращает ID запуска.
+
+        Если пока шел обход, в основной базе появился запуск с тем же ID,
+        запуску назначается следующий свободный ID.
+        """
+        return self._retry(self._publish_once, retries)
+
+    def publish_diffs(self, retries: int = STAGING_PUBLISH_RETRIES) -> int:
+        """Переносит завершенные сравнения запуска (diff_pairs и diff_records) в основную базу,
+        возвращает число перенесенных пар"""
+        return self._retry(self._publish_diffs_once, retries)
+
+    @staticmethod
+    def _retry(publish, retries: int):
+        """Повторяет перенос до retries раз, если основная база занята другим подключением"""
+        for attempt in range(1, retries + 1):
+            try:
+                return publish()
+            except sqlite3.OperationalError as e:
+                if attempt == retries or 'locked' not in str(e):
+                    raise
+                print(f"Основная база данных занята ({str(e)}), повторная публикация {attempt + 1} из {retries}")
+
+    @contextmanager
+    def _store_transaction(self):
+        """Подключение к промежуточной базе с присоединенной основной (store) внутри транзакции записи"""
+        raw_connection = self.engine.raw_connection()
+        conn = raw_connection.driver_connection
+        try:
+            # Ожидание, пока читатели основной базы не завершат свои транзакции
+            conn.execute(f"PRAGMA busy_timeout = {int(STAGING_BUSY_TIMEOUT * 1000)}")
+            conn.execute("ATTACH DATABASE ? AS store", (str(self.db_path),))
+            try:
+                # Блокировка записи берется сразу, чтобы ID не заняли до конца переноса
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield conn
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            finally:
+                conn.execute("DETACH DATABASE store")
+        finally:
+            raw_connection.close()
+
+    def _publish_once(self) -> int:
+        """Одна попытка переноса данных запуска в основную базу"""
+        with self._store_transaction() as conn:
+            last_run_id, company_offset = conn.execute(
+                "SELECT (SELECT COALESCE(MAX(id), 0) FROM store.parsing_runs), "
+                "(SELECT COALESCE(MAX(id), 0) FROM store.companies)"
+            ).fetchone()
+            params = {
+                'run_id': max(self.run_id, last_run_id + 1),
+                'company_offset': company_offset,
+            }
+            for table, overrides in PUBLISH_TABLES:
+                conn.execute(_publish_statement(table, overrides), params)
+        return params['run_id']
+
+    def _publish_diffs_once(self) -> int:
+        """Одна попытка переноса сравнений запуска в основную базу"""
+        published = 0
+        with self._store_transaction() as conn:
+            # Пара с total_changes = NULL не была дописана (см. DiffTableSink)
+            pairs = conn.execute(
+                "SELECT id, prev_run_id, last_run_id, total_changes, computed_at "
+                "FROM main.diff_pairs WHERE total_changes IS NOT NULL ORDER BY id"
+            ).fetchall()
+            for pair_id, prev_run_id, last_run_id, total_changes, computed_at in pairs:
+                incomplete = ("SELECT id FROM store.diff_pairs "
+                              "WHERE prev_run_id = ? AND last_run_id = ? AND total_changes IS NULL")
+                conn.execute(f"DELETE FROM store.diff_records WHERE diff_pair_id IN ({incomplete})",
+                             (prev_run_id, last_run_id))
+                conn.execute(f"DELETE FROM store.diff_pairs WHERE id IN ({incomplete})",
+                             (prev_run_id, last_run_id))
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO store.diff_pairs (prev_run_id, last_run_id, total_changes, computed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (prev_run_id, last_run_id, total_changes, computed_at)
+                )
+                if cursor.rowcount == 0:
+                    # Пару уже сохранил analyze_diff
+                    continue
+                conn.execute(
+                    "INSERT INTO store.diff_records (diff_pair_id, entity, change, ticker, payload) "
+                    "SELECT ?, entity, change, ticker, payload FROM main.diff_records "
+                    "WHERE diff_pair_id = ? ORDER BY id",
+                    (cursor.lastrowid, pair_id)
+                )
+                published += 1
+        return published
+
+    def close(self) -> None:
+        """Закрывает подключения к промежуточной базе, не удаляя ее файл"""
+        self.engine.dispose()
+
+    def discard(self) -> None:
+        """Закрывает промежуточную базу и удаляет ее файл"""
+        self.close()
+        if self.path is not None and self.path.exists():
+            os.remove(self.path)